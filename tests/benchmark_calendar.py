@@ -0,0 +1,76 @@
+"""
+Benchmark of the calendar page parser against requests_html, which it replaced: the time to parse each saved
+calendar page and a year long page built from them, and the time each parser takes to import in a fresh interpreter.
+
+    python -m tests.benchmark_calendar [--repeat N] [--weeks WEEKS]
+"""
+import argparse
+import re
+import subprocess
+import sys
+import timeit
+from pathlib import Path
+
+from trainaspower import trainasone
+
+calendar_pages = sorted((Path(__file__).parent / "data" / "calendarView").glob("*.html"))
+base_url = "https://beta.trainasone.com/calendarView"
+
+
+def long_page(page: str, weeks: int) -> str:
+    """The page with its weeks repeated until it has `weeks` of them."""
+    week_html = re.findall(r'\n    <div class="week">.*?\n    </div>', page, re.DOTALL)
+    body = "".join(week_html[n % len(week_html)] for n in range(weeks))
+    return page.replace("".join(week_html), body)
+
+
+def parse_requests_html(page: str) -> list:
+    import requests_html
+
+    html = requests_html.HTML(url=base_url, html=page)
+    return [
+        (day.find(".title", first=True).text, day.find(".workout a", first=True).absolute_links.pop())
+        for day in html.find(".today, .future")
+        if day.find(".workout")
+    ]
+
+
+def import_seconds(module: str, repeat: int) -> float:
+    """Best time to import a module in a new interpreter."""
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    return min(
+        float(subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout)
+        for _ in range(repeat)
+    )
+
+
+def best_seconds(func, repeat: int, number: int = 20) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark calendar page parsing against requests_html")
+    parser.add_argument("--repeat", type=int, default=5, help="Timings to take the best of")
+    parser.add_argument("--weeks", type=int, default=52, help="Weeks of the long page")
+    args = parser.parse_args()
+
+    pages = {path.name: path.read_text(encoding="utf-8") for path in calendar_pages}
+    pages[f"{args.weeks} weeks"] = long_page(pages["month.html"], args.weeks)
+    print(f"{'page':>16} {'days':>5} {'lxml ms':>9} {'requests_html ms':>17} {'speedup':>8}")
+    for name, page in pages.items():
+        days = trainasone.parse_calendar(page, base_url)
+        assert parse_requests_html(page) == days
+        lxml_seconds = best_seconds(lambda: trainasone.parse_calendar(page, base_url), args.repeat)
+        requests_html_seconds = best_seconds(lambda: parse_requests_html(page), args.repeat)
+        print(
+            f"{name:>16} {len(days):>5} {lxml_seconds * 1000:>9.3f} {requests_html_seconds * 1000:>17.3f} "
+            f"{requests_html_seconds / lxml_seconds:>7.1f}x"
+        )
+
+    print(f"\n{'import':>16} {'ms':>9}")
+    for module in ("lxml.html", "requests_html"):
+        print(f"{module:>16} {import_seconds(module, args.repeat) * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main_benchmark()
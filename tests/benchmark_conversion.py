@@ -0,0 +1,94 @@
+"""
+Benchmark of building workouts from their FIT steps: `trainasone.convert_steps` and `finalsurge.convert_workout` on
+large synthetic interval workouts. Stryd powers are requested from the stand-in services before timing, so only the
+conversion itself is measured.
+
+    python -m tests.benchmark_conversion [--steps 300 3000 30000] [--repeat N]
+"""
+import argparse
+import datetime
+import sys
+import time
+from typing import List
+
+from loguru import logger
+
+from trainaspower import finalsurge, fit, models, stryd, trainasone, transport
+from tests.benchmark_sync import benchmark_config
+from tests.standin import StandInAdapter, use_standin
+
+
+def synthetic_steps(steps: int) -> List[dict]:
+    """FIT steps of an interval workout with about `steps` steps, as `fit.read_workout` gives them."""
+    fit_steps = [{
+        "wkt_step_name": "Warm up", "notes": "Warm up", "intensity": "warmup", "duration_type": "time",
+        "duration_time": 600.0, "target_type": "speed", "custom_target_speed_low": 2.5, "custom_target_speed_high": 3.0,
+    }]
+    for interval in range(max(1, (steps - 2) // 3)):
+        # Paces vary, so the powers of many distinct paces are looked up
+        faster = 0.02 * (interval % 50)
+        fit_steps.extend([
+            {
+                "wkt_step_name": "Fast", "notes": "Fast", "intensity": "active", "duration_type": "distance",
+                "duration_distance": 400.0, "target_type": "speed",
+                "custom_target_speed_low": 4.0 + faster, "custom_target_speed_high": 4.5 + faster,
+            },
+            {
+                "wkt_step_name": "Recovery", "notes": "Recovery", "intensity": "rest", "duration_type": "time",
+                "duration_time": 90.0, "target_type": "open",
+            },
+            {"duration_type": "repeat_until_steps_cmplt", "duration_step": len(fit_steps), "repeat_steps": 2},
+        ])
+    fit_steps.append({
+        "wkt_step_name": "Cool down", "notes": "Cool down", "intensity": "cooldown", "duration_type": "time",
+        "duration_time": 600.0, "target_type": "open",
+    })
+    return fit.read_workout(fit.write_workout("Synthetic intervals", fit_steps)).steps
+
+
+def conversion_seconds(steps: List[dict], config: models.Config, stryd_client: stryd.Stryd, repeat: int) -> tuple:
+    """Best seconds of `convert_steps` and of `convert_workout` over `repeat` runs."""
+    # Not timed, it asks Stryd for the critical power and the suggested power ranges
+    trainasone.convert_steps(steps, config, False, stryd_client)
+    convert_times, workout_times = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        workout = models.Workout()
+        workout.name = "Synthetic intervals"
+        workout.date = datetime.date.today()
+        workout.steps = trainasone.convert_steps(steps, config, False, stryd_client)
+        converted = time.perf_counter()
+        finalsurge.convert_workout(workout)
+        convert_times.append(converted - started)
+        workout_times.append(time.perf_counter() - converted)
+    return min(convert_times), min(workout_times)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark converting large workouts")
+    parser.add_argument("--steps", type=int, nargs="+", default=[300, 3000, 30000], help="Workout sizes")
+    parser.add_argument("--repeat", type=int, default=5, help="Timings to take the best of")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    config = benchmark_config(1)
+    use_standin(StandInAdapter())
+    try:
+        stryd_client = stryd.Stryd(config.stryd_concurrency)
+        stryd_client.login(config.stryd_email, config.stryd_password)
+        print(f"{'steps':>6} {'convert_steps ms':>17} {'convert_workout ms':>19} {'us per step':>12}")
+        for size in args.steps:
+            steps = synthetic_steps(size)
+            stryd_client.resolve_paces(trainasone.step_paces(steps))
+            convert, workout = conversion_seconds(steps, config, stryd_client, args.repeat)
+            print(
+                f"{len(steps):>6} {convert * 1000:>17.2f} {workout * 1000:>19.2f} "
+                f"{(convert + workout) / len(steps) * 1e6:>12.2f}"
+            )
+    finally:
+        transport.stop()
+
+
+if __name__ == "__main__":
+    main_benchmark()
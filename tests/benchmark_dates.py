@@ -0,0 +1,84 @@
+"""
+Benchmark of reading calendar day titles: `trainasone.parse_calendar_date` against the dateparser fallback it leaves
+unusual titles to, per call over a corpus of titles, and for the first call in a new interpreter.
+
+    python -m tests.benchmark_dates [--repeat N]
+"""
+import argparse
+import datetime
+import subprocess
+import sys
+import timeit
+from pathlib import Path
+
+from trainaspower import trainasone
+
+calendar_pages = sorted((Path(__file__).parent / "data" / "calendarView").glob("*.html"))
+base_url = "https://beta.trainasone.com/calendarView"
+
+# Titles in the other formats TrainAsOne has used
+other_titles = [
+    "Today", "Tomorrow", "Sat 17 Oct", "Mon 19 Oct", "Thursday, 22nd October", "Sat Oct 24",
+    "Wednesday, October 28th", "1 Nov", "Nov. 2", "3 Sept", "Friday 1 January 2027", "Jan 2, 2027",
+]
+
+
+def title_corpus() -> list:
+    """The day titles of the saved calendar pages, as `TrainAsOne.get_calendar` reads them, and the other formats."""
+    titles = [
+        title.splitlines()[-1]
+        for path in calendar_pages
+        for title, _ in trainasone.parse_calendar(path.read_text(encoding="utf-8"), base_url)
+    ]
+    return titles + other_titles
+
+
+def first_call_seconds(title: str, repeat: int) -> float:
+    """Best time of a first `parse_calendar_date` call in a new interpreter, after trainaspower is imported."""
+    code = (
+        "import time; from trainaspower import trainasone; started = time.perf_counter(); "
+        f"trainasone.parse_calendar_date({title!r}); print(time.perf_counter() - started)"
+    )
+    return min(
+        float(subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout)
+        for _ in range(repeat)
+    )
+
+
+def per_call_seconds(func, titles: list, repeat: int, number: int = 20) -> float:
+    def parse_all():
+        for title in titles:
+            func(title)
+
+    return min(timeit.repeat(parse_all, number=number, repeat=repeat)) / number / len(titles)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark calendar date parsing against dateparser")
+    parser.add_argument("--repeat", type=int, default=5, help="Timings to take the best of")
+    args = parser.parse_args()
+
+    import dateparser
+
+    today = datetime.date.today()
+    titles = title_corpus()
+    timed = {
+        "parse_calendar_date": lambda title: trainasone.parse_calendar_date(title, today),
+        # Uncached, as for the first title in an unknown format each day
+        "dateparser fallback": lambda title: trainasone.dateparser_parse.__wrapped__(title, today),
+        "memoized fallback": lambda title: trainasone.dateparser_parse(title, today),
+        "dateparser.parse": dateparser.parse,
+    }
+    print(f"{len(titles)} titles\n\n{'per call':>20} {'us':>9}")
+    for name, func in timed.items():
+        print(f"{name:>20} {per_call_seconds(func, titles, args.repeat) * 1e6:>9.1f}")
+
+    # The fallback imports dateparser on its first call
+    first_calls = {"parse_calendar_date": "Sat 17 Oct", "dateparser fallback": "2026-10-17"}
+    print(f"\n{'first call':>20} {'ms':>9}")
+    for name, title in first_calls.items():
+        print(f"{name:>20} {first_call_seconds(title, args.repeat) * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main_benchmark()
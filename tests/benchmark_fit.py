@@ -0,0 +1,57 @@
+"""
+Benchmark of the FIT workout decoder against fitparse, which it replaced: the time to read the name and steps of each
+workout file in tests/data/fit, the way each was used to read TrainAsOne downloads, and of a workout file with many
+steps written with `fit.write_workout`.
+
+    python -m tests.benchmark_fit [--repeat N]
+"""
+import argparse
+import timeit
+from pathlib import Path
+
+import fitparse
+
+from trainaspower import fit
+from tests.benchmark_conversion import synthetic_steps
+
+fit_files = sorted((Path(__file__).parent / "data" / "fit").glob("*.fit"))
+
+
+def read_fitparse(data: bytes) -> tuple:
+    """The workout name and steps, read as TrainAsOne downloads were before `fit.read_workout`."""
+    fit_file = fitparse.FitFile(data)
+    workout = next(fit_file.get_messages("workout", as_dict=True))
+    name = next(field["value"] for field in workout["fields"] if field["name"] == "wkt_name")
+    steps = [
+        {field["name"]: field["value"] for field in step["fields"]}
+        for step in fit_file.get_messages("workout_step", as_dict=True)
+    ]
+    steps.sort(key=lambda step: step["message_index"])
+    return name, steps
+
+
+def best_seconds(func, repeat: int, number: int = 20) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark the FIT decoder against fitparse")
+    parser.add_argument("--repeat", type=int, default=5, help="Timings to take the best of")
+    args = parser.parse_args()
+
+    files = {path.name: path.read_bytes() for path in fit_files}
+    files["300 steps"] = fit.write_workout("Synthetic intervals", synthetic_steps(300))
+    print(f"{'file':>26} {'bytes':>6} {'steps':>6} {'read_workout ms':>16} {'fitparse ms':>12} {'speedup':>8}")
+    for name, data in files.items():
+        workout = fit.read_workout(data)
+        assert read_fitparse(data)[0] == workout.name
+        read_seconds = best_seconds(lambda: fit.read_workout(data), args.repeat)
+        fitparse_seconds = best_seconds(lambda: read_fitparse(data), args.repeat)
+        print(
+            f"{name:>26} {len(data):>6} {len(workout.steps):>6} {read_seconds * 1000:>16.3f} "
+            f"{fitparse_seconds * 1000:>12.3f} {fitparse_seconds / read_seconds:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,107 @@
+"""
+Benchmark of whole syncs against the stand-in services, reporting the wall time and the requests made to each
+service for syncs of 1, 7 and 28 workouts. Each size is synced twice, the second time with nothing changed.
+
+    python -m tests.benchmark_sync [--latency SECONDS] [--async] [--workouts 1 7 28] [--pace-conversion model]
+"""
+import argparse
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List
+
+from loguru import logger
+
+from trainaspower import main, models, syncing, transport
+from tests.standin import StandInAdapter, use_standin
+
+services = ("trainasone", "stryd", "finalsurge")
+prediction_path = "/b/api/v1/users/race/prediction"
+
+
+def benchmark_config(workouts: int, pace_conversion: str = "stryd") -> models.Config:
+    # Nothing is saved between runs, so every sync starts from the same state
+    return models.Config(
+        stryd_email="athlete@example.com",
+        stryd_password="stryd",
+        trainasone_email="athlete@example.com",
+        trainasone_password="trainasone",
+        finalsurge_email="athlete@example.com",
+        finalsurge_password="finalsurge",
+        number_of_workouts=workouts,
+        pace_conversion=pace_conversion,
+        remember_logins=False,
+        resume_syncs=False,
+    )
+
+
+def run(workouts: int, latency: float, use_async: bool = False, pace_conversion: str = "stryd") -> List[dict]:
+    """
+    Syncs `workouts` workouts twice against one stand-in. Returns the time, results and requests of each sync, and
+    the Stryd calculator requests among them.
+
+    Files such as pace tables are written to a temporary directory, which the second sync shares with the first.
+    """
+    if use_async:
+        from trainaspower import aio
+
+        sync = aio.run_sync
+    else:
+        sync = main.sync
+    config = benchmark_config(workouts, pace_conversion)
+    standin = StandInAdapter(workouts, latency)
+    runs = []
+    directory = syncing.directory
+    try:
+        with tempfile.TemporaryDirectory() as temp_directory:
+            syncing.directory = Path(temp_directory)
+            for name in ("first", "unchanged"):
+                use_standin(standin)
+                standin.calls.clear()
+                started = time.perf_counter()
+                results = sync(config)
+                runs.append({
+                    "workouts": workouts,
+                    "run": name,
+                    "seconds": time.perf_counter() - started,
+                    "results": results,
+                    "requests": Counter({service: standin.host_requests(service) for service in services}),
+                    "predictions": standin.calls[("GET", "www.stryd.com", prediction_path)],
+                })
+    finally:
+        syncing.directory = directory
+        transport.stop()
+    return runs
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark syncs against stand-in services")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds spent on every request")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Sync with the asyncio engine")
+    parser.add_argument("--workouts", type=int, nargs="+", default=[1, 7, 28], help="Sync sizes to benchmark")
+    parser.add_argument(
+        "--pace-conversion", choices=["stryd", "model", "table"], default="stryd", help="How paces become power"
+    )
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    print(
+        f"{'workouts':>8} {'run':>9} {'seconds':>8} {'requests':>8} "
+        + " ".join(f"{s:>10}" for s in services)
+        + f" {'predictions':>11}"
+    )
+    for workouts in args.workouts:
+        for result in run(workouts, args.latency, args.use_async, args.pace_conversion):
+            requests = result["requests"]
+            print(
+                f"{result['workouts']:>8} {result['run']:>9} {result['seconds']:>8.2f} {sum(requests.values()):>8} "
+                + " ".join(f"{requests[s]:>10}" for s in services)
+                + f" {result['predictions']:>11}"
+            )
+
+
+if __name__ == "__main__":
+    main_benchmark()
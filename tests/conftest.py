@@ -0,0 +1,13 @@
+import pytest
+
+from trainaspower import transport
+from tests.standin import StandInAdapter, use_standin
+
+
+@pytest.fixture
+def standin():
+    """Stand-in services with a week of workouts, used by every session made during the test."""
+    adapter = StandInAdapter(workouts=7)
+    use_standin(adapter)
+    yield adapter
+    transport.stop()
@@ -0,0 +1,197 @@
+"""
+Stand-in for the TrainAsOne, Stryd and Final Surge services, answering requests in process without any network access.
+
+Mount it with `use_standin`, like `transport.start_replay` mounts a cassette. It serves a calendar of generated
+workouts, answers Stryd conversions from a simple pace to power curve, and keeps the workouts uploaded to Final Surge
+so later syncs see them. Every request can be delayed by a fixed latency, and failures can be injected per endpoint.
+"""
+import datetime
+import json
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from trainaspower import fit, transport
+
+stryd_user_id = "42"
+critical_power = 250
+
+
+def workout_steps(number: int) -> List[dict]:
+    """FIT steps of a TrainAsOne interval workout, with paces which differ from workout to workout."""
+    faster = 0.05 * (number % 10)
+    return [
+        {
+            "wkt_step_name": "Warm up", "notes": "Warm up", "intensity": "warmup", "duration_type": "time",
+            "duration_time": 600.0, "target_type": "speed",
+            "custom_target_speed_low": 2.5 + faster, "custom_target_speed_high": 3.0 + faster,
+        },
+        {
+            "wkt_step_name": "Fast", "notes": "Fast", "intensity": "active", "duration_type": "distance",
+            "duration_distance": 400.0, "target_type": "speed",
+            "custom_target_speed_low": 4.0 + faster, "custom_target_speed_high": 4.5 + faster,
+        },
+        {
+            "wkt_step_name": "Recovery", "notes": "Recovery", "intensity": "rest", "duration_type": "time",
+            "duration_time": 90.0, "target_type": "speed",
+            "custom_target_speed_low": 2.0 + faster, "custom_target_speed_high": 2.4 + faster,
+        },
+        {"duration_type": "repeat_until_steps_cmplt", "duration_step": 1, "repeat_steps": 5},
+        {
+            "wkt_step_name": "Cool down", "notes": "Cool down", "intensity": "cooldown", "duration_type": "time",
+            "duration_time": 600.0, "target_type": "speed",
+            "custom_target_speed_low": 2.5 + faster, "custom_target_speed_high": 3.0 + faster,
+        },
+    ]
+
+
+class StandInAdapter(HTTPAdapter):
+    """
+    Answers the requests of a sync like the real services would.
+
+    The calendar has a workout on each of the next `workouts` days. `latency` seconds are spent on every request.
+    """
+
+    def __init__(self, workouts: int = 1, latency: float = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.lock = threading.Lock()
+        # Requests by method, host and path
+        self.calls: Counter = Counter()
+        # Workout number of each calendar day, which a test can change between syncs
+        today = datetime.date.today()
+        self.calendar: Dict[datetime.date, int] = {today + datetime.timedelta(n): n + 1 for n in range(workouts)}
+        # Final Surge workouts by key, with their builder steps once saved
+        self.finalsurge: Dict[str, dict] = {}
+        # Failures to inject by method and path: how many requests pass first, how many more fail, and the status
+        # or exception
+        self.failures: Dict[Tuple[str, str], list] = {}
+
+    def fail(self, method: str, path: str, status: Optional[int] = None, times: int = 1, after: int = 0) -> None:
+        """
+        Makes `times` requests to an endpoint answer `status`, or raise a connection error, once `after` more have
+        been answered.
+        """
+        self.failures[(method, path)] = [after, times, status]
+
+    def host_requests(self, host: str) -> int:
+        """How many requests were made to a host, such as `stryd`."""
+        return sum(count for (_, request_host, _), count in self.calls.items() if host in request_host)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+        with self.lock:
+            self.calls[(request.method, parts.netloc, parts.path)] += 1
+            failure = self.failures.get((request.method, parts.path))
+            if failure and failure[0] > 0:
+                failure[0] -= 1
+                failure = None
+            elif failure and failure[1] > 0:
+                failure[1] -= 1
+            else:
+                failure = None
+        if self.latency:
+            time.sleep(self.latency)
+        if failure:
+            if failure[2] is None:
+                raise requests.ConnectionError(f"Injected failure of {request.method} {parts.path}", request=request)
+            return self.response(request, failure[2], b"Injected failure")
+        body = request.body.decode("utf-8") if isinstance(request.body, bytes) else request.body
+        if parts.netloc == "beta.trainasone.com":
+            return self.trainasone(request, parts.path, query, body)
+        if parts.netloc == "www.stryd.com":
+            return self.stryd(request, parts.path, query)
+        if parts.netloc == "beta.finalsurge.com":
+            with self.lock:
+                return self.final_surge(request, parts.path, query, body)
+        return self.response(request, 404)
+
+    def response(self, request, status: int = 200, content: bytes = b"", headers: Optional[dict] = None):
+        response = requests.Response()
+        response.status_code = status
+        response.reason = "OK" if status < 400 else "Error"
+        response.headers = CaseInsensitiveDict(headers or {})
+        response._content = content
+        response._content_consumed = True
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = datetime.timedelta(seconds=self.latency)
+        return response
+
+    def json(self, request, data) -> requests.Response:
+        return self.response(request, content=json.dumps(data).encode("utf-8"))
+
+    def trainasone(self, request, path: str, query: dict, body: Optional[str]) -> requests.Response:
+        if path == "/login":
+            return self.response(request, 302, headers={"Location": "/home"})
+        if path == "/calendarView":
+            days = "".join(
+                f'<div class="day {"today" if day == datetime.date.today() else "future"}">'
+                f'<div class="title"><div>{day:%a %d %b}</div></div>'
+                f'<div class="workout"><a href="/plannedWorkout?workoutId=W{number}">Workout {number}</a></div></div>'
+                for day, number in sorted(self.calendar.items())
+            )
+            return self.response(request, content=f"<html><body>{days}</body></html>".encode("utf-8"))
+        if path == "/plannedWorkoutDownload":
+            number = int(parse_qs(body)["workoutId"][0][1:])
+            return self.response(request, content=fit.write_workout(f"{number} Intervals", workout_steps(number)))
+        if path == "/plannedWorkout":
+            page = '<div class="detail"><span>45 minutes, 10 seconds</span> (~8.5 km)</div>'
+            return self.response(request, content=page.encode("utf-8"))
+        return self.response(request, 404)
+
+    def stryd(self, request, path: str, query: dict) -> requests.Response:
+        if path == "/b/email/signin":
+            return self.json(request, {"token": "stryd-token", "id": stryd_user_id})
+        if path == "/b/api/v1/users/race/prediction":
+            # Power goes up with speed, and the suggested range with distance
+            power = 100000 / float(query["target_time"])
+            distance = float(query["race_distance"])
+            return self.json(request, {
+                "power_range": {"target": power},
+                "power_range_suggested": {"min": 300 - distance / 100, "max": 320 - distance / 100},
+            })
+        if path == "/b/api/v1/users/powerdurationcurve":
+            return self.json(request, [{"power_list": [400 - n * 0.01 for n in range(7200)]}])
+        if path == f"/b/api/v1/users/{stryd_user_id}":
+            return self.json(request, {"training_info": {"critical_power": critical_power}})
+        return self.response(request, 404)
+
+    def final_surge(self, request, path: str, query: dict, body: Optional[str]) -> requests.Response:
+        if path == "/api/login":
+            return self.json(request, {"success": True, "data": {"token": "finalsurge-token", "user_key": "U1"}})
+        if path == "/api/WorkoutList":
+            start, end = query["startdate"], query["enddate"]
+            workouts = [
+                {key: value for key, value in workout.items() if key != "steps"}
+                for workout in self.finalsurge.values()
+                if start <= workout["workout_date"][:10] <= end
+            ]
+            return self.json(request, {"data": workouts})
+        if path == "/api/WorkoutSave":
+            data = json.loads(body)
+            key = data["key"] or f"K{len(self.finalsurge) + 1}"
+            workout = self.finalsurge.setdefault(key, {"key": key, "workout_completion": 0, "steps": None})
+            workout.update(workout_date=data["workout_date"], name=data["name"], description=data["description"])
+            return self.json(request, {"new_workout_key": key})
+        if path == "/api/WorkoutBuilderSave":
+            self.finalsurge[query["workout_key"]]["steps"] = json.loads(body)
+            return self.json(request, {"success": True})
+        if path == "/api/WorkoutDelete":
+            self.finalsurge.pop(query["workout_key"], None)
+            return self.json(request, {"success": True})
+        return self.response(request, 404)
+
+
+def use_standin(adapter: StandInAdapter) -> None:
+    """Sends the requests of every new session to the stand-in, until `transport.stop`."""
+    transport.adapter = adapter
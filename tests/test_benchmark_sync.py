@@ -0,0 +1,28 @@
+import pytest
+
+from tests import benchmark_sync
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["threads", "asyncio"])
+@pytest.mark.parametrize("workouts", [1, 7])
+def test_benchmark_requests(workouts, use_async):
+    first, unchanged = benchmark_sync.run(workouts, latency=0, use_async=use_async)
+    assert first["results"]["created"] == workouts
+    assert unchanged["results"]["skipped"] == workouts
+    # Login, calendar, and the FIT file and page of every workout
+    assert first["requests"]["trainasone"] == unchanged["requests"]["trainasone"] == 2 + 2 * workouts
+    # Login, index, and each workout saved, its steps saved and its hash saved
+    assert first["requests"]["finalsurge"] == 2 + 3 * workouts
+    # Nothing is written to Final Surge when nothing has changed
+    assert unchanged["requests"]["finalsurge"] == 2
+
+
+@pytest.mark.parametrize("pace_conversion", ["model", "table"])
+def test_async_converts_with_pace_model_and_table(pace_conversion):
+    threads = benchmark_sync.run(7, latency=0, use_async=False, pace_conversion=pace_conversion)
+    asyncio = benchmark_sync.run(7, latency=0, use_async=True, pace_conversion=pace_conversion)
+    # Paces are only requested from Stryd once the model or table is loaded, on either engine
+    assert [run["predictions"] for run in asyncio] == [run["predictions"] for run in threads]
+    if pace_conversion == "table":
+        # The table built by the first sync answers every pace of the second
+        assert threads[1]["predictions"] == 0
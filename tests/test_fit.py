@@ -0,0 +1,90 @@
+import datetime
+from pathlib import Path
+
+import pytest
+
+from trainaspower import fit
+
+fitparse = pytest.importorskip("fitparse")
+
+fit_files = sorted((Path(__file__).parent / "data" / "fit").glob("*.fit"))
+
+
+def fitparse_workout(data: bytes):
+    """Workout name and steps as fitparse decodes them."""
+    fit_file = fitparse.FitFile(data)
+    fit_file.parse()
+    (workout,) = fit_file.get_messages("workout", as_dict=False)
+    steps = [message.get_values() for message in fit_file.get_messages("workout_step")]
+    return fit_file, workout.get_value("wkt_name"), steps
+
+
+def values(step: dict) -> dict:
+    return {name: value for name, value in step.items() if value is not None}
+
+
+def assert_steps_match(steps, expected_steps):
+    assert len(steps) == len(expected_steps)
+    for step, expected in zip(steps, expected_steps):
+        # fitparse also returns the fields TrainAsOne does not use
+        assert step == {name: expected.get(name) for name in step}
+
+
+@pytest.mark.parametrize("path", fit_files, ids=lambda p: p.name)
+def test_read_workout_matches_fitparse(path):
+    data = path.read_bytes()
+    _, name, steps = fitparse_workout(data)
+    workout = fit.read_workout(data)
+    assert workout.name == name
+    assert_steps_match(workout.steps, steps)
+
+
+@pytest.mark.parametrize("path", fit_files, ids=lambda p: p.name)
+def test_read_workout_rejects_corrupt_files(path):
+    data = bytearray(path.read_bytes())
+    data[len(data) // 2] ^= 0xFF
+    with pytest.raises(fit.FitError):
+        fit.read_workout(bytes(data))
+    with pytest.raises(fit.FitError):
+        fit.read_workout(bytes(data[:-10]))
+
+
+@pytest.mark.parametrize("path", fit_files, ids=lambda p: p.name)
+def test_write_workout_round_trips(path):
+    original = fit.read_workout(path.read_bytes())
+    steps = [{name: value for name, value in step.items() if name != "message_index"} for step in original.steps]
+    data = fit.write_workout(original.name, steps)
+    fit_file, name, fitparse_steps = fitparse_workout(data)
+    assert name == original.name
+    assert [values(step) for step in fitparse_steps] == [values(step) for step in original.steps]
+    workout = fit.read_workout(data)
+    assert workout.name == original.name
+    assert [values(step) for step in workout.steps] == [values(step) for step in original.steps]
+
+
+def test_write_workout_power_targets_and_header():
+    created = datetime.datetime(2026, 10, 17, 6, 30, tzinfo=datetime.timezone.utc)
+    steps = [
+        {
+            "wkt_step_name": "Fast",
+            "notes": "Fast",
+            "intensity": "active",
+            "duration_type": "distance",
+            "duration_distance": 400.0,
+            "target_type": "power",
+            "target_power_zone": 0,
+            "custom_target_power_low": 280 + fit.power_offset,
+            "custom_target_power_high": 300 + fit.power_offset,
+        },
+        {"wkt_step_name": "Repeat", "duration_type": "repeat_until_steps_cmplt", "duration_step": 0, "repeat_steps": 4},
+        {"wkt_step_name": "Run back", "intensity": "active", "duration_type": "open", "target_type": "open"},
+    ]
+    data = fit.write_workout("12 Intervals", steps, created)
+    fit_file, name, fitparse_steps = fitparse_workout(data)
+    (file_id,) = fit_file.get_messages("file_id")
+    assert file_id.get_value("type") == "workout"
+    assert file_id.get_value("time_created") == created.replace(tzinfo=None)
+    assert name == "12 Intervals"
+    assert [step.get("custom_target_power_low") for step in fitparse_steps] == [1280, None, None]
+    assert fitparse_steps[1]["repeat_steps"] == 4
+    assert_steps_match(fit.read_workout(data).steps, fitparse_steps)
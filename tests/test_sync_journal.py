@@ -0,0 +1,73 @@
+import pytest
+
+from trainaspower import finalsurge, main, syncing
+from tests import benchmark_sync
+
+download_path = "/plannedWorkoutDownload"
+
+# Where the first sync fails: the request, the status it answers or None for a connection error, and how many of
+# the same requests succeed first. Downloads fail on the last workout, uploads on the second once the first is on
+# Final Surge.
+failures = {
+    "fetch": ("POST", download_path, None, 6),
+    "convert": ("GET", "/b/api/v1/users/race/prediction", 500, 0),
+    "workout save": ("POST", "/api/WorkoutSave", 500, 2),
+    "builder save connection": ("POST", "/api/WorkoutBuilderSave", None, 1),
+    "builder save error": ("POST", "/api/WorkoutBuilderSave", 500, 1),
+    "hash save": ("POST", "/api/WorkoutSave", None, 3),
+}
+
+# What the sync after the failure does
+rerun_results = {
+    "fetch": {"created": 7},
+    "convert": {"created": 7},
+    "workout save": {"skipped": 1, "created": 6},
+    "builder save connection": {"skipped": 1, "updated": 1, "created": 5},
+    "builder save error": {"skipped": 1, "updated": 1, "created": 5},
+    "hash save": {"skipped": 1, "updated": 1, "created": 5},
+}
+
+
+@pytest.fixture
+def journal_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(syncing, "journal_directory", tmp_path / "journal")
+    return tmp_path / "journal"
+
+
+def path_requests(standin, path: str) -> int:
+    return sum(count for (_, _, request_path), count in standin.calls.items() if request_path == path)
+
+
+@pytest.mark.parametrize("resume_syncs", [True, False], ids=["journal", "no journal"])
+@pytest.mark.parametrize("stage", failures)
+def test_sync_after_failure(standin, journal_directory, stage, resume_syncs):
+    config = benchmark_sync.benchmark_config(7)
+    config.resume_syncs = resume_syncs
+    # One download at a time, so those before the failing one have all finished when the sync fails
+    config.trainasone_concurrency = 1
+    method, path, status, after = failures[stage]
+    standin.fail(method, path, status, after=after)
+
+    with pytest.raises(Exception):
+        main.sync(config)
+    assert main.sync(config) == rerun_results[stage]
+
+    # The journal keeps the downloads of the failed sync, and is removed once a sync succeeds
+    if resume_syncs:
+        rerun_downloads = 1 if stage == "fetch" else 0
+    else:
+        rerun_downloads = 7
+    assert path_requests(standin, download_path) == 7 + rerun_downloads
+    assert not journal_directory.exists() or not any(journal_directory.iterdir())
+
+    # Every workout is on Final Surge once, with its steps and the hash of what was uploaded
+    workouts = list(standin.finalsurge.values())
+    assert len(workouts) == 7
+    assert len({workout["workout_date"] for workout in workouts}) == 7
+    for workout in workouts:
+        assert workout["steps"] is not None
+        assert workout["description"].startswith(f"{finalsurge.uploading_description} [")
+
+    standin.calls.clear()
+    assert main.sync(config) == {"skipped": 7}
+    assert standin.host_requests("finalsurge") == 2
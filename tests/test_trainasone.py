@@ -0,0 +1,95 @@
+import datetime
+from pathlib import Path
+
+import pytest
+from lxml import html
+
+from trainaspower import trainasone
+
+calendar_pages = sorted((Path(__file__).parent / "data" / "calendarView").glob("*.html"))
+base_url = "https://beta.trainasone.com/calendarView"
+
+
+def read_page(path: Path) -> str:
+    return path.read_text(encoding="utf-8")
+
+
+@pytest.mark.parametrize("path", calendar_pages, ids=lambda p: p.name)
+def test_element_text_matches_pyquery(path):
+    pyquery_text = pytest.importorskip("pyquery.text")
+    tree = html.fromstring(read_page(path))
+    for element in tree.iter():
+        if isinstance(element.tag, str):
+            assert trainasone.element_text(element) == pyquery_text.extract_text(element), element
+
+
+@pytest.mark.parametrize("path", calendar_pages, ids=lambda p: p.name)
+def test_parse_calendar_matches_requests_html(path):
+    requests_html = pytest.importorskip("requests_html")
+    page = requests_html.HTML(url=base_url, html=read_page(path))
+    expected = [
+        (day.find(".title", first=True).text, day.find(".workout a", first=True).absolute_links.pop())
+        for day in page.find(".today, .future")
+        if day.find(".workout")
+    ]
+    assert expected
+    assert trainasone.parse_calendar(read_page(path), base_url) == expected
+
+
+def test_element_text_keeps_non_breaking_spaces():
+    element = html.fromstring("<div><div>Sat&nbsp;17 Oct</div>  <span>\n a  b </span></div>")
+    assert trainasone.element_text(element) == "Sat\xa017 Oct\na b"
+
+
+@pytest.mark.parametrize(
+    "title, expected",
+    [
+        ("Today", datetime.datetime(2026, 10, 17)),
+        ("tomorrow", datetime.datetime(2026, 10, 18)),
+        ("Sat 17 Oct", datetime.datetime(2026, 10, 17)),
+        ("Sat\xa017 Oct", datetime.datetime(2026, 10, 17)),
+        ("Mon 19 Oct", datetime.datetime(2026, 10, 19)),
+        ("Tue  20   Oct", datetime.datetime(2026, 10, 20)),
+        ("Thursday, 22nd October", datetime.datetime(2026, 10, 22)),
+        ("Sat Oct 24", datetime.datetime(2026, 10, 24)),
+        ("Wednesday, October 28th", datetime.datetime(2026, 10, 28)),
+        ("1 Nov", datetime.datetime(2026, 11, 1)),
+        ("Nov. 2", datetime.datetime(2026, 11, 2)),
+        ("3 Sept", datetime.datetime(2026, 9, 3)),
+        ("Friday 1 January 2027", datetime.datetime(2027, 1, 1)),
+        ("Jan 2, 2027", datetime.datetime(2027, 1, 2)),
+    ],
+)
+def test_parse_calendar_date(title, expected):
+    assert trainasone.parse_calendar_date(title, datetime.date(2026, 10, 17)) == expected
+
+
+@pytest.mark.parametrize(
+    "title, today, expected",
+    [
+        # Titles without a year get the year which puts them closest to today
+        ("Fri 1 Jan", datetime.date(2026, 12, 30), datetime.datetime(2027, 1, 1)),
+        ("Jan 5", datetime.date(2026, 10, 17), datetime.datetime(2027, 1, 5)),
+        ("Wed 30 Dec", datetime.date(2027, 1, 2), datetime.datetime(2026, 12, 30)),
+        ("31 Dec", datetime.date(2026, 12, 31), datetime.datetime(2026, 12, 31)),
+        ("Today", datetime.date(2026, 12, 31), datetime.datetime(2026, 12, 31)),
+        ("Tomorrow", datetime.date(2026, 12, 31), datetime.datetime(2027, 1, 1)),
+    ],
+)
+def test_parse_calendar_date_year_rollover(title, today, expected):
+    assert trainasone.parse_calendar_date(title, today) == expected
+
+
+def test_parse_calendar_date_falls_back_to_dateparser(monkeypatch):
+    calls = []
+
+    def dateparser_parse(text, today):
+        calls.append((text, today))
+        return datetime.datetime(2026, 10, 20)
+
+    monkeypatch.setattr(trainasone, "dateparser_parse", dateparser_parse)
+    today = datetime.date(2026, 10, 17)
+    assert trainasone.parse_calendar_date("2026-10-20", today) == datetime.datetime(2026, 10, 20)
+    # 29 Feb of a year without it is not a date the fast path can make
+    trainasone.parse_calendar_date("29 Feb 2027", today)
+    assert calls == [("2026-10-20", today), ("29 Feb 2027", today)]
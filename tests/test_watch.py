@@ -0,0 +1,41 @@
+import datetime
+
+import pytest
+
+from trainaspower import finalsurge, main, stryd, syncing, trainasone
+from tests import benchmark_sync
+
+
+@pytest.fixture
+def clients(standin):
+    config = benchmark_sync.benchmark_config(7)
+    tao_client, finalsurge_client = trainasone.TrainAsOne(), finalsurge.FinalSurge()
+    stryd_client = stryd.Stryd(config.stryd_concurrency)
+    syncing.login(config, tao_client, finalsurge_client, stryd_client)
+    return config, tao_client, finalsurge_client, stryd_client
+
+
+def final_surge_days(standin) -> list:
+    return sorted(datetime.date.fromisoformat(workout["workout_date"][:10]) for workout in standin.finalsurge.values())
+
+
+@pytest.mark.parametrize("removed_day", [2, 6], ids=["middle day", "last day"])
+def test_sync_changed_days_deletes_removed_days(standin, clients, removed_day):
+    fingerprints = {}
+    assert main.sync_changed_days(*clients, fingerprints) == {"created": 7}
+    days = sorted(standin.calendar)
+    del standin.calendar[days[removed_day]]
+
+    assert main.sync_changed_days(*clients, fingerprints) == {"deleted": 1}
+    assert final_surge_days(standin) == [day for day in days if day != days[removed_day]]
+    assert days[removed_day] not in fingerprints
+
+
+def test_sync_changed_days_deletes_every_day_when_calendar_is_empty(standin, clients):
+    fingerprints = {}
+    main.sync_changed_days(*clients, fingerprints)
+    standin.calendar.clear()
+
+    assert main.sync_changed_days(*clients, fingerprints) == {"deleted": 7}
+    assert standin.finalsurge == {}
+    assert fingerprints == {}
@@ -0,0 +1,274 @@
+"""
+Asyncio interface to the TrainAsOne, Stryd and Final Surge clients.
+
+The clients stay blocking `requests` sessions, which already pool and keep their connections alive. Their calls run
+on a thread pool, limited to a number at a time for each service, so one event loop can overlap the work of every
+workout, service and athlete.
+"""
+import asyncio
+import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Iterable, List, Optional
+
+from loguru import logger
+
+from trainaspower import finalsurge, journal, models, stryd, syncing, timings, trainasone
+
+
+class ServiceLimits:
+    """How many calls to each service may run at the same time, shared by every athlete."""
+
+    def __init__(self, trainasone: int, stryd: int, finalsurge: int):
+        sizes = {"trainasone": trainasone, "stryd": stryd, "finalsurge": finalsurge}
+        self.semaphores = {service: asyncio.Semaphore(size) for service, size in sizes.items()}
+        # Room for every service at its limit, and for local work such as loading saved sessions
+        self.executor = ThreadPoolExecutor(max_workers=sum(sizes.values()) + 1)
+
+    async def run(self, service: Optional[str], func, *args):
+        """Runs a blocking call on the thread pool, waiting for a free slot of `service` first."""
+        loop = asyncio.get_running_loop()
+        if service is None:
+            return await loop.run_in_executor(self.executor, partial(func, *args))
+        async with self.semaphores[service]:
+            return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def timed(phase: str, func, *args):
+    with timings.phase(phase):
+        return func(*args)
+
+
+class AsyncStryd:
+    def __init__(self, client: stryd.Stryd, limits: ServiceLimits):
+        self.client = client
+        self.limits = limits
+        # Conversions by seconds per mile, so a pace is only requested once however many steps use it
+        self.conversions: Dict[int, asyncio.Future] = {}
+        # Loading of the pace model or table, which every conversion waits for
+        self.pace_conversion: Optional[asyncio.Future] = None
+
+    async def login(self, email: str, password: str) -> None:
+        await self.limits.run("stryd", self.client.login, email, password)
+
+    async def get_power_from_seconds_per_mile(self, seconds: int) -> float:
+        conversion = self.conversions.get(seconds)
+        if conversion is None:
+            conversion = asyncio.ensure_future(
+                self.limits.run("stryd", timed, "conversion", self.client.get_power_from_seconds_per_mile, seconds)
+            )
+            self.conversions[seconds] = conversion
+        return await conversion
+
+    async def get_power_from_pace(self, pace: float) -> float:
+        """Power for a pace in seconds per meter."""
+        seconds = stryd.seconds_per_mile(pace)
+        if seconds <= 0:
+            return 0
+        return await self.get_power_from_seconds_per_mile(seconds)
+
+    async def resolve_paces(self, paces: Iterable[float]) -> None:
+        """Converts many paces (in seconds per meter) at once, so the client has them in memory."""
+        await asyncio.gather(*(self.get_power_from_pace(pace) for pace in set(paces)))
+
+    async def load_pace_conversion(self, config: models.Config) -> None:
+        """Loads the pace model or table the first time it is called, later calls wait for the same load."""
+        if self.pace_conversion is None:
+            self.pace_conversion = asyncio.ensure_future(
+                self.limits.run("stryd", syncing.load_pace_conversion, config, self.client)
+            )
+        await self.pace_conversion
+
+
+class AsyncTrainAsOne:
+    def __init__(self, client: trainasone.TrainAsOne, limits: ServiceLimits):
+        self.client = client
+        self.limits = limits
+
+    async def login(self, email: str, password: str) -> None:
+        await self.limits.run("trainasone", self.client.login, email, password)
+
+    async def get_calendar(self) -> list:
+        return await self.limits.run("trainasone", self.client.get_calendar)
+
+    async def fetch_workout(
+        self, workout_url: str, date: datetime.date, config: models.Config, sync_journal: Optional[journal.Journal]
+    ) -> tuple:
+        return await self.limits.run(
+            "trainasone", self.client.fetch_workout, workout_url, date, config, sync_journal
+        )
+
+    async def get_workout(
+        self,
+        workout_url: str,
+        date: datetime.date,
+        config: models.Config,
+        stryd_client: AsyncStryd,
+        sync_journal: Optional[journal.Journal] = None,
+    ) -> models.Workout:
+        """Downloads and converts a workout, requesting its paces from Stryd as soon as it is downloaded."""
+        try:
+            workout_id, w, steps = await self.fetch_workout(workout_url, date, config, sync_journal)
+            if steps is None or await self.limits.run(
+                "stryd", trainasone.reuse_conversion, w, config, stryd_client.client
+            ):
+                return w
+            # Paces are only requested from Stryd once the model or table has been given the chance to answer them
+            await stryd_client.load_pace_conversion(config)
+            if not config.pace_only:
+                await stryd_client.resolve_paces(trainasone.step_paces(steps))
+            w = await self.limits.run(
+                "stryd", trainasone.convert_workout_steps, w, steps, config, stryd_client.client
+            )
+            if sync_journal:
+                sync_journal.record_converted(workout_id, w)
+            return w
+        except trainasone.FindWorkoutException:
+            raise
+        except Exception as exc:
+            raise trainasone.FindWorkoutException(
+                f"Error finding next TaO workout: {exc.args[0]}", "taocalendar.html", self.client.calendar_html
+            ) from exc
+
+    async def get_next_workouts(
+        self, config: models.Config, stryd_client: AsyncStryd, sync_journal: Optional[journal.Journal] = None
+    ) -> List[asyncio.Future]:
+        """Starts getting the next `config.number_of_workouts` workouts, and returns them in date order."""
+        calendar = (await self.get_calendar())[: config.number_of_workouts]
+        if not calendar:
+            raise trainasone.FindWorkoutException(
+                "Error finding next TaO workout: Next tao workout not found.",
+                "taocalendar.html",
+                self.client.calendar_html,
+            )
+        return [
+            asyncio.ensure_future(self.get_workout(workout_url, date, config, stryd_client, sync_journal))
+            for date, workout_url in calendar
+        ]
+
+
+class AsyncFinalSurge:
+    def __init__(self, client: finalsurge.FinalSurge, limits: ServiceLimits):
+        self.client = client
+        self.limits = limits
+        # The workout index of the client is not safe to change from several threads
+        self.lock = asyncio.Lock()
+
+    async def call(self, func, *args):
+        async with self.lock:
+            return await self.limits.run("finalsurge", func, *args)
+
+    async def login(self, email: str, password: str) -> None:
+        await self.call(self.client.login, email, password)
+
+    async def index_workouts(self, start_date: datetime.date, end_date: datetime.date) -> None:
+        await self.call(self.client.index_workouts, start_date, end_date)
+
+    async def add_workout(self, workout: models.Workout, sync_journal: Optional[journal.Journal] = None) -> str:
+        return await self.call(timed, "upload", syncing.upload_workout, self.client, workout, sync_journal)
+
+    async def remove_workout(self, wo_date: datetime.date) -> bool:
+        return await self.call(timed, "upload", self.client.remove_workout, wo_date)
+
+
+async def sync(config: models.Config, limits: ServiceLimits) -> Counter:
+    """Same as `main.sync`, with the logins, downloads, conversions and the Final Surge index overlapped."""
+    tao_client = AsyncTrainAsOne(trainasone.TrainAsOne(), limits)
+    finalsurge_client = AsyncFinalSurge(finalsurge.FinalSurge(), limits)
+    stryd_client = AsyncStryd(stryd.Stryd(config.stryd_concurrency), limits)
+    clients = (tao_client.client, finalsurge_client.client, stryd_client.client)
+
+    saved = await limits.run(None, syncing.session_store.load, config) if config.remember_logins else {}
+    await asyncio.gather(*(
+        limits.run(name, syncing.login_service, name, client, email, password, saved)
+        for name, client, email, password in syncing.services(config, *clients)
+    ))
+    timings.mark("logins")
+    sync_journal = await limits.run(None, syncing.open_journal, config)
+    try:
+        results = await sync_workouts(config, tao_client, finalsurge_client, stryd_client, sync_journal)
+        if sync_journal:
+            sync_journal.clear()
+        return results
+    finally:
+        # Sessions may have been renewed during the sync
+        await limits.run(None, syncing.save_sessions, config, *clients)
+
+
+async def sync_workouts(
+    config: models.Config,
+    tao_client: AsyncTrainAsOne,
+    finalsurge_client: AsyncFinalSurge,
+    stryd_client: AsyncStryd,
+    sync_journal: Optional[journal.Journal] = None,
+) -> Counter:
+    start_date = datetime.date.today()
+    workouts, _ = await asyncio.gather(
+        tao_client.get_next_workouts(config, stryd_client, sync_journal),
+        stryd_client.load_pace_conversion(config),
+    )
+    results = Counter()
+    synced, cleared = [], []
+    try:
+        # Load the Final Surge workouts of every day we may touch while the workouts are converted
+        await finalsurge_client.index_workouts(start_date, start_date + finalsurge.index_window)
+        for workout in workouts:
+            wo = await workout
+            # Clear any cancelled workouts
+            for wo_date in syncing.daterange(start_date, wo.date):
+                if await finalsurge_client.remove_workout(wo_date):
+                    results["deleted"] += 1
+                cleared.append(wo_date)
+            # Add the new workout
+            results[await finalsurge_client.add_workout(wo, sync_journal)] += 1
+            synced.append(wo)
+            start_date = wo.date + datetime.timedelta(1)
+    finally:
+        for workout in workouts:
+            workout.cancel()
+    await finalsurge_client.limits.run(None, syncing.store_plan, config, synced, cleared)
+    timings.mark("sync")
+    return results
+
+
+async def sync_batch(configs: List[models.Config], workers: int) -> list:
+    """Syncs every athlete on one event loop, `workers` at a time. Returns the results or exception of each."""
+    limits = ServiceLimits(
+        trainasone=max(config.trainasone_concurrency for config in configs),
+        stryd=max(config.stryd_concurrency for config in configs),
+        finalsurge=workers,
+    )
+    athletes = asyncio.Semaphore(workers)
+
+    async def sync_athlete(config: models.Config) -> Counter:
+        async with athletes:
+            if len(configs) > 1:
+                logger.info(f"Syncing athlete {config.trainasone_email}")
+            return await sync(config, limits)
+
+    try:
+        return await asyncio.gather(*(sync_athlete(config) for config in configs), return_exceptions=True)
+    finally:
+        limits.close()
+
+
+def run_sync(config: models.Config) -> Counter:
+    """Async replacement for `main.sync`."""
+    (outcome,) = asyncio.run(sync_batch([config], 1))
+    if isinstance(outcome, BaseException):
+        raise outcome
+    return outcome
+
+
+def run_batch(configs: List[models.Config], workers: int) -> bool:
+    """Async replacement for `main.sync_batch`."""
+    outcomes = asyncio.run(sync_batch(configs, workers))
+    outcomes = [
+        syncing.batch_failure(config, outcome) if isinstance(outcome, trainasone.FindWorkoutException) else outcome
+        for config, outcome in zip(configs, outcomes)
+    ]
+    return syncing.log_batch_summary(configs, outcomes)
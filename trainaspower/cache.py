@@ -0,0 +1,85 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Optional
+
+from loguru import logger
+
+
+class Cache:
+    """Small persistent key/value store backed by SQLite, with TTL and size based eviction."""
+
+    def __init__(self, path: Path, ttl: timedelta, max_entries: int):
+        self.ttl = ttl.total_seconds()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, created REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created)")
+        self.evict()
+
+    def get(self, namespace: str, key: str, max_age: Optional[timedelta] = None) -> Any:
+        max_age = self.ttl if max_age is None else max_age.total_seconds()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        if row is None or row[1] < time.time() - max_age:
+            return None
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, created) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), time.time()),
+            )
+
+    def clear(self, namespace_prefix: str) -> None:
+        """Removes every entry whose namespace starts with `namespace_prefix`."""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM entries WHERE substr(namespace, 1, ?) = ?",
+                (len(namespace_prefix), namespace_prefix),
+            )
+
+    def evict(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+            self._db.execute(
+                "DELETE FROM entries WHERE rowid IN "
+                "(SELECT rowid FROM entries ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def close(self) -> None:
+        self.evict()
+        with self._lock:
+            self._db.close()
+
+
+store: Optional[Cache] = None
+
+
+def open_store(path: Path, ttl: timedelta, max_entries: int) -> None:
+    global store
+    try:
+        store = Cache(path, ttl, max_entries)
+    except sqlite3.Error:
+        logger.opt(exception=True).warning(f"Could not open cache `{path}`, continuing without it")
+        store = None
+
+
+def close_store() -> None:
+    global store
+    if store is not None:
+        store.close()
+        store = None
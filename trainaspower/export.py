@@ -0,0 +1,145 @@
+"""
+Writers for `trainaspower export`, which saves converted workouts as Final Surge payloads and FIT workout files.
+
+Each workout is written as soon as it is converted, so nothing is held in memory however many are exported.
+"""
+import base64
+import io
+import json
+import tarfile
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+from trainaspower import finalsurge, fit, models
+
+intensities = {"WARMUP": "warmup", "COOLDOWN": "cooldown", "ACTIVE": "active", "REST": "rest"}
+
+
+def fit_steps(steps: List[models.Step]) -> List[dict]:
+    """The steps as FIT workout steps, with repeats after the steps they repeat."""
+    fit_steps_out = []
+    for step in steps:
+        if isinstance(step, models.RepeatStep):
+            first_step = len(fit_steps_out)
+            fit_steps_out.extend(fit_steps(step.steps))
+            fit_steps_out.append({
+                "wkt_step_name": step.description,
+                "duration_type": "repeat_until_steps_cmplt",
+                "duration_step": first_step,
+                "repeat_steps": step.repetitions,
+            })
+            continue
+        fit_step = {
+            "wkt_step_name": step.description,
+            "notes": step.description,
+            "intensity": intensities.get(step.type, "active"),
+        }
+        if step.length_type == "time":
+            fit_step.update(duration_type="time", duration_time=step.length)
+        elif step.length_type == "distance":
+            fit_step.update(duration_type="distance", duration_distance=step.length)
+        else:
+            fit_step.update(duration_type="open")
+        if step.power_range:
+            fit_step.update(
+                target_type="power",
+                target_power_zone=0,
+                custom_target_power_low=round(step.power_range.min) + fit.power_offset,
+                custom_target_power_high=round(step.power_range.max) + fit.power_offset,
+            )
+        elif step.pace_range:
+            # Paces are seconds per meter, the slowest first
+            fit_step.update(
+                target_type="speed",
+                target_speed_zone=0,
+                custom_target_speed_low=1 / step.pace_range.min if step.pace_range.min else 0,
+                custom_target_speed_high=1 / step.pace_range.max,
+            )
+        else:
+            fit_step.update(target_type="open")
+        fit_steps_out.append(fit_step)
+    return fit_steps_out
+
+
+def workout_files(workout: models.Workout) -> Tuple[dict, bytes]:
+    """The Final Surge payloads and the FIT workout file of a workout."""
+    workout_data, builder = finalsurge.workout_payload(workout)
+    payload = {
+        "date": finalsurge.as_date(workout.date).isoformat(),
+        "name": workout.name,
+        "workout": workout_data,
+        "workout_builder": builder,
+    }
+    return payload, fit.write_workout(workout.name, fit_steps(workout.steps), workout.date)
+
+
+def workout_stem(workout: models.Workout, prefix: str) -> str:
+    return f"{prefix}{finalsurge.as_date(workout.date).isoformat()}-{workout.id}"
+
+
+class DirectoryExport:
+    """Writes `<date>-<workout number>.json` and `.fit` files to a directory."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def add_file(self, name: str, data: bytes) -> None:
+        file = self.path / name
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(data)
+
+    def write(self, workout: models.Workout, prefix: str = "") -> None:
+        payload, fit_file = workout_files(workout)
+        stem = workout_stem(workout, prefix)
+        self.add_file(f"{stem}.json", json.dumps(payload, indent=2).encode("utf-8"))
+        self.add_file(f"{stem}.fit", fit_file)
+
+    def close(self) -> None:
+        pass
+
+
+class TarExport(DirectoryExport):
+    """Writes the files of `DirectoryExport` to a tar archive, compressed when it is named `.tar.gz` or `.tgz`."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        compressed = path.name.endswith((".tar.gz", ".tgz"))
+        self.tar = tarfile.open(path, "w:gz" if compressed else "w")
+
+    def add_file(self, name: str, data: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self) -> None:
+        self.tar.close()
+
+
+class JsonlExport:
+    """Writes a line for each workout, with the FIT file base64 encoded."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, workout: models.Workout, prefix: str = "") -> None:
+        payload, fit_file = workout_files(workout)
+        payload["file"] = workout_stem(workout, prefix)
+        payload["fit"] = base64.b64encode(fit_file).decode("ascii")
+        self.file.write(json.dumps(payload) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def open_export(path: Path):
+    """The writer for the output path, chosen by its name."""
+    if path.name.endswith(".jsonl"):
+        return JsonlExport(path)
+    if path.name.endswith((".tar", ".tar.gz", ".tgz")):
+        return TarExport(path)
+    return DirectoryExport(path)
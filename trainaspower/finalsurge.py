@@ -1,41 +1,19 @@
+from __future__ import annotations
+
+import hashlib
 import json
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from itertools import count
-from typing import Optional, Union
+from typing import Dict, Optional, Union
 
 import requests
 from loguru import logger
-from pint import Quantity
-
-from trainaspower import models
-
-finalsurge_session = requests.Session()
-
-
-user_key = "NOT LOGGED IN"
 
+from trainaspower import models, transport
 
-def login(email: str, password: str) -> None:
-    login_params = {
-        "email": email,
-        "password": password,
-        "deviceManufacturer": "",
-        "deviceModel": "Netscape",
-        "deviceOperatingSystem": "Win32",
-        "deviceUniqueIdentifier": "",
-    }
-    r = finalsurge_session.post(
-        "https://beta.finalsurge.com/api/login",
-        json=login_params,
-    )
-    login_info = r.json()
-    if not login_info["success"]:
-        raise Exception("Failed to log in to Final Surge")
-    finalsurge_session.headers.update(
-        {"Authorization": f"Bearer {login_info['data']['token']}"}
-    )
-    global user_key
-    user_key = login_info["data"]["user_key"]
+index_window = timedelta(days=14)
+# Description of a workout until its steps are saved, the hash of its content is added after that
+uploading_description = "TrainAsPower converted workout"
 
 
 def convert_workout(workout: models.Workout) -> dict:
@@ -54,8 +32,9 @@ def convert_workout(workout: models.Workout) -> dict:
     return result
 
 
-def pace_to_time(pace: Quantity) -> str:
-    pace = pace.to("minute/kilometer").magnitude
+def pace_to_time(pace: float) -> str:
+    """Formats a pace in seconds per meter as minutes per kilometer."""
+    pace = pace * 1000 / 60
     mins = int(pace)
     secs = int(60 * (pace % 1))
     return f"{mins:02d}:{secs:02d}"
@@ -68,16 +47,16 @@ def convert_step(step: models.Step, id_counter) -> dict:
         raise ValueError(f"unknown step type received {step.type}")
     if step.length is None:
         s = {"durationType": "OPEN"}
-    elif step.length.check("[time]"):
+    elif step.length_type == "time":
         s = {
             "durationType": "TIME",
-            "duration": str(timedelta(seconds=step.length.to("seconds").magnitude)),
+            "duration": str(timedelta(seconds=step.length)),
         }
     else:
         s = {
             "durationType": "DISTANCE",
-            "durationDist": step.length.magnitude,
-            "distUnit": f"{step.length.units:~}",
+            "durationDist": step.length,
+            "distUnit": "m",
         }
 
     target_open = {
@@ -143,79 +122,189 @@ def convert_repeat(step: models.RepeatStep, id_counter) -> dict:
     }
 
 
-def get_existing_tap_workout(wo_date: date) -> Optional[str]:
-    """Checks if TrainAsPower already has an (uncompleted) workout on the same day as given workout."""
-    logger.debug(f"Checking TrainAsPower workout exists on Final Surge")
-    params = {
-        "scope": "USER",
-        "scopekey": user_key,
-        "startdate": wo_date.strftime("%Y-%m-%d"),
-        "enddate": wo_date.strftime("%Y-%m-%d"),
-        "ishistory": False,
-        "completedonly": False,
+def as_date(wo_date: Union[date, datetime]) -> date:
+    return wo_date.date() if isinstance(wo_date, datetime) else wo_date
+
+
+def content_hash(*payloads) -> str:
+    """Stable short hash of JSON serializable payloads."""
+    serialized = json.dumps(payloads, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:16]
+
+
+def workout_payload(workout: models.Workout) -> tuple[dict, dict]:
+    """The workout details and the workout builder steps uploaded for a workout."""
+    workout_data = {
+        "workout_date": workout.date.isoformat(),
+        "order": 1,
+        "name": workout.name,
+        "is_race": False,
+        "Activity": {
+            "activity_type_key": "00000001-0001-0001-0001-000000000001",
+            "activity_type_name": "Run",
+            "planned_amount": round(workout.distance / models.meters_per_unit[workout.distance_unit], 2),
+            "planned_amount_type": workout.distance_unit,
+            "planned_duration": round(workout.duration),
+        },
     }
-    data = finalsurge_session.get(
-        "https://beta.finalsurge.com/api/WorkoutList", params=params
-    ).json()
-    for existing_workout in data["data"]:
-        if existing_workout["workout_completion"] == 1:
-            continue
-        if "TrainAsPower" in (existing_workout["description"] or ""):
-            return existing_workout["key"]
-    return None
-
-
-def add_workout(workout: models.Workout) -> None:
-    wo_key = get_existing_tap_workout(workout.date)
-    if wo_key:
-        logger.info(f"Updating workout `{workout.name}` on Final Surge")
-    else:
-        logger.info(f"Posting workout `{workout.name}` to Final Surge")
-    wo = convert_workout(workout)
-    params = {"scope": "USER", "scope_key": user_key}
-
-    add_wo = finalsurge_session.post(
-        "https://beta.finalsurge.com/api/WorkoutSave",
-        params=params,
-        data=json.dumps({
+    return workout_data, convert_workout(workout)
+
+
+def payload_hash(workout: models.Workout) -> str:
+    return content_hash(*workout_payload(workout))
+
+
+class FinalSurge:
+    """Final Surge session for a single athlete."""
+
+    def __init__(self):
+        self.session = transport.new_session()
+        self.user_key = "NOT LOGGED IN"
+        self.token = None
+        self.credentials = None
+        # Uncompleted TrainAsPower workouts on Final Surge by date, None where a date has been checked and has none
+        self.workout_index: Dict[date, Optional[dict]] = {}
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        r = self.session.request(method, url, **kwargs)
+        if r.status_code == 401 and self.credentials:
+            logger.info("Final Surge session expired, logging in again")
+            self.login(*self.credentials)
+            r = self.session.request(method, url, **kwargs)
+        return r
+
+    def login(self, email: str, password: str) -> None:
+        self.credentials = (email, password)
+        login_params = {
+            "email": email,
+            "password": password,
+            "deviceManufacturer": "",
+            "deviceModel": "Netscape",
+            "deviceOperatingSystem": "Win32",
+            "deviceUniqueIdentifier": "",
+        }
+        r = self.session.post(
+            "https://beta.finalsurge.com/api/login",
+            json=login_params,
+        )
+        login_info = r.json()
+        if not login_info["success"]:
+            raise Exception("Failed to log in to Final Surge")
+        self.authorize(login_info["data"]["token"], login_info["data"]["user_key"])
+
+    def authorize(self, token: str, user_key: str) -> None:
+        self.token = token
+        self.user_key = user_key
+        self.session.headers.update({"Authorization": f"Bearer {token}"})
+
+    def session_state(self) -> dict:
+        return {"token": self.token, "user_key": self.user_key}
+
+    def restore_session(self, email: str, password: str, state: dict) -> None:
+        """Reuses a session saved by `session_state`, logging in again with the credentials once it expires."""
+        self.credentials = (email, password)
+        self.authorize(state["token"], state["user_key"])
+
+    def index_workouts(self, start_date: date, end_date: date) -> None:
+        """Loads all TrainAsPower workouts between the given dates (inclusive) with a single request."""
+        logger.debug(f"Fetching TrainAsPower workouts on Final Surge from {start_date} to {end_date}")
+        params = {
+            "scope": "USER",
+            "scopekey": self.user_key,
+            "startdate": start_date.strftime("%Y-%m-%d"),
+            "enddate": end_date.strftime("%Y-%m-%d"),
+            "ishistory": False,
+            "completedonly": False,
+        }
+        data = self.request(
+            "GET", "https://beta.finalsurge.com/api/WorkoutList", params=params
+        ).json()
+        for n in range((end_date - start_date).days + 1):
+            self.workout_index[start_date + timedelta(n)] = None
+        for existing_workout in data["data"]:
+            if existing_workout["workout_completion"] == 1:
+                continue
+            if "TrainAsPower" not in (existing_workout["description"] or ""):
+                continue
+            wo_date = date.fromisoformat(existing_workout["workout_date"][:10])
+            if self.workout_index.get(wo_date) is None:
+                self.workout_index[wo_date] = existing_workout
+
+    def get_existing_tap_workout(self, wo_date: date) -> Optional[str]:
+        """Checks if TrainAsPower already has an (uncompleted) workout on the same day as given workout."""
+        wo_date = as_date(wo_date)
+        if wo_date not in self.workout_index:
+            self.index_workouts(wo_date, wo_date + index_window)
+        existing_workout = self.workout_index[wo_date]
+        return existing_workout["key"] if existing_workout else None
+
+    def add_workout(self, workout: models.Workout) -> str:
+        """
+        Creates or updates the workout on Final Surge. Returns one of `created`, `updated` or `skipped`.
+
+        The hash an unchanged workout is recognized by is only saved once its steps are, so a workout whose upload
+        failed part way is sent again.
+        """
+        wo_key = self.get_existing_tap_workout(workout.date)
+        existing_workout = self.workout_index[as_date(workout.date)] or {}
+        workout_data, wo = workout_payload(workout)
+        description = f"{uploading_description} [{content_hash(workout_data, wo)}]"
+        if wo_key and existing_workout.get("description") == description:
+            logger.info(f"Workout `{workout.name}` is unchanged on Final Surge")
+            return "skipped"
+        if wo_key:
+            logger.info(f"Updating workout `{workout.name}` on Final Surge")
+        else:
+            logger.info(f"Posting workout `{workout.name}` to Final Surge")
+        result = "updated" if wo_key else "created"
+        wo_key = self.save_workout(wo_key, workout_data, uploading_description)
+        params = {
+            "scope": "USER",
+            "scopekey": self.user_key,
+            "workout_key": wo_key,
+        }
+        self.request(
+            "POST", "https://beta.finalsurge.com/api/WorkoutBuilderSave", params=params, json=wo
+        ).raise_for_status()
+        self.save_workout(wo_key, workout_data, description)
+        self.workout_index[as_date(workout.date)] = {
             "key": wo_key,
-            "workout_date": workout.date.isoformat(),
-            "order": 1,
             "name": workout.name,
-            "description": "TrainAsPower converted workout",
-            "is_race": False,
-            "Activity": {
-                "activity_type_key": "00000001-0001-0001-0001-000000000001",
-                "activity_type_name": "Run",
-                "planned_amount": workout.distance.magnitude,
-                "planned_amount_type": f"{workout.distance.units:~}",
-                "planned_duration": round(workout.duration.to("seconds").magnitude),
-            },
-        }).encode("utf-8"),
-        headers={'Content-Type': 'application/json; charset=UTF-8'},
-    )
-    if not wo_key:
-        wo_key = add_wo.json()["new_workout_key"]
-    params = {
-        "scope": "USER",
-        "scopekey": user_key,
-        "workout_key": wo_key,
-    }
-    finalsurge_session.post(
-        "https://beta.finalsurge.com/api/WorkoutBuilderSave", params=params, json=wo
-    )
+            "description": description,
+            "workout_completion": 0,
+        }
+        return result
 
+    def save_workout(self, wo_key: Optional[str], workout_data: dict, description: str) -> str:
+        """Saves the workout details, creating the workout when there is no key. Returns the workout's key."""
+        params = {"scope": "USER", "scope_key": self.user_key}
+        r = self.request(
+            "POST",
+            "https://beta.finalsurge.com/api/WorkoutSave",
+            params=params,
+            data=json.dumps({
+                "key": wo_key,
+                **workout_data,
+                "description": description,
+            }).encode("utf-8"),
+            headers={'Content-Type': 'application/json; charset=UTF-8'},
+        )
+        r.raise_for_status()
+        return wo_key or r.json()["new_workout_key"]
 
-def remove_workout(wo_date: date) -> None:
-    wo_key = get_existing_tap_workout(wo_date)
-    if not wo_key:
-        return
-    logger.info(f"Deleting existing TrainAsPower workout `{wo_key}`")
-    params = {
-        "scope": "USER",
-        "scopekey": user_key,
-        "workout_key": wo_key,
-    }
-    response = finalsurge_session.get(
-        "https://beta.finalsurge.com/api/WorkoutDelete", params=params
-    )
+    def remove_workout(self, wo_date: date) -> bool:
+        """Deletes the TrainAsPower workout on the given date, if there is one. Returns whether one was deleted."""
+        wo_key = self.get_existing_tap_workout(wo_date)
+        if not wo_key:
+            return False
+        logger.info(f"Deleting existing TrainAsPower workout `{wo_key}`")
+        params = {
+            "scope": "USER",
+            "scopekey": self.user_key,
+            "workout_key": wo_key,
+        }
+        response = self.request(
+            "GET", "https://beta.finalsurge.com/api/WorkoutDelete", params=params
+        )
+        self.workout_index[as_date(wo_date)] = None
+        return True
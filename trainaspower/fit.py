@@ -0,0 +1,361 @@
+"""
+Decoder and encoder for FIT workout files.
+
+Only the `workout` and `workout_step` messages are read, and only the fields TrainAsOne uses. Field names, scaling,
+enum names and subfield names follow the FIT profile (and so fitparse), so the decoded steps can be used in place of
+`fitparse.FitFile.get_messages("workout_step", as_dict=True)`. Steps in the same form can be written back to a FIT
+workout file.
+"""
+import datetime
+import struct
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class FitError(Exception):
+    pass
+
+
+def make_crc_table() -> List[int]:
+    # FIT files use CRC-16/ARC
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+crc_table = make_crc_table()
+
+
+def crc16(data, crc: int = 0) -> int:
+    for byte in data:
+        crc = (crc >> 8) ^ crc_table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+# Base type: struct format character and the value meaning "invalid", strings are handled separately
+base_types = {
+    0x00: ("B", 0xFF),  # enum
+    0x01: ("b", 0x7F),  # sint8
+    0x02: ("B", 0xFF),  # uint8
+    0x83: ("h", 0x7FFF),  # sint16
+    0x84: ("H", 0xFFFF),  # uint16
+    0x85: ("i", 0x7FFFFFFF),  # sint32
+    0x86: ("I", 0xFFFFFFFF),  # uint32
+    0x0A: ("B", 0x00),  # uint8z
+    0x8B: ("H", 0x0000),  # uint16z
+    0x8C: ("I", 0x00000000),  # uint32z
+    0x8E: ("q", 0x7FFFFFFFFFFFFFFF),  # sint64
+    0x8F: ("Q", 0xFFFFFFFFFFFFFFFF),  # uint64
+    0x90: ("Q", 0x0000000000000000),  # uint64z
+}
+string_type = 0x07
+
+wkt_step_duration = {
+    0: "time", 1: "distance", 2: "hr_less_than", 3: "hr_greater_than", 4: "calories", 5: "open",
+    6: "repeat_until_steps_cmplt", 7: "repeat_until_time", 8: "repeat_until_distance", 9: "repeat_until_calories",
+    10: "repeat_until_hr_less_than", 11: "repeat_until_hr_greater_than", 12: "repeat_until_power_less_than",
+    13: "repeat_until_power_greater_than", 14: "power_less_than", 15: "power_greater_than",
+    16: "training_peaks_tss", 17: "repeat_until_power_last_lap_less_than",
+    18: "repeat_until_max_power_last_lap_less_than", 19: "power_3s_less_than", 20: "power_10s_less_than",
+    21: "power_30s_less_than", 22: "power_3s_greater_than", 23: "power_10s_greater_than",
+    24: "power_30s_greater_than", 25: "power_lap_less_than", 26: "power_lap_greater_than",
+    27: "repeat_until_training_peaks_tss", 28: "repetition_time", 29: "reps",
+}
+wkt_step_target = {
+    0: "speed", 1: "heart_rate", 2: "open", 3: "cadence", 4: "power", 5: "grade", 6: "resistance", 7: "power_3s",
+    8: "power_10s", 9: "power_30s", 10: "power_lap", 11: "swim_stroke", 12: "speed_lap", 13: "heart_rate_lap",
+}
+intensity = {0: "active", 1: "rest", 2: "warmup", 3: "cooldown"}
+file_type = {1: "device", 2: "settings", 3: "sport", 4: "activity", 5: "workout", 6: "course", 7: "schedules"}
+sport = {0: "generic", 1: "running", 2: "cycling", 3: "transition", 4: "fitness_equipment", 5: "swimming"}
+
+# Custom power targets from this value up are watts plus this value, below it they are % of FTP
+power_offset = 1000
+
+
+class Field(NamedTuple):
+    name: str
+    enum: Optional[Dict[int, str]] = None
+    scale: int = 1
+    # Alternative names and scales, chosen by the raw value of another field of the message, first match wins
+    subfields: Tuple[Tuple[str, int, frozenset, int], ...] = ()
+    # Base type the field is written as, it is read as whatever the file says
+    base_type: int = 0x84
+
+
+duration_type, target_type = 1, 3
+enum_type, uint32_type = 0x00, 0x86
+
+file_id_message = 0
+file_id_fields = {
+    0: Field("type", file_type, base_type=enum_type),
+    1: Field("manufacturer"),
+    2: Field("product"),
+    4: Field("time_created", base_type=uint32_type),
+}
+
+workout_message = 26
+workout_fields = {
+    4: Field("sport", sport, base_type=enum_type),
+    6: Field("num_valid_steps"),
+    8: Field("wkt_name", base_type=0x07),
+}
+
+workout_step_message = 27
+workout_step_fields = {
+    254: Field("message_index"),
+    0: Field("wkt_step_name", base_type=0x07),
+    1: Field("duration_type", wkt_step_duration, base_type=enum_type),
+    2: Field("duration_value", base_type=uint32_type, subfields=(
+        ("duration_calories", duration_type, frozenset({4}), 1),
+        ("duration_distance", duration_type, frozenset({1}), 100),
+        ("duration_hr", duration_type, frozenset({2, 3}), 1),
+        ("duration_power", duration_type, frozenset({14, 15}), 1),
+        ("duration_reps", duration_type, frozenset({29}), 1),
+        ("duration_step", duration_type, frozenset(range(6, 14)), 1),
+        ("duration_time", duration_type, frozenset({0, 28}), 1000),
+    )),
+    3: Field("target_type", wkt_step_target, base_type=enum_type),
+    4: Field("target_value", base_type=uint32_type, subfields=(
+        ("repeat_calories", duration_type, frozenset({9}), 1),
+        ("repeat_distance", duration_type, frozenset({8}), 100),
+        ("repeat_hr", duration_type, frozenset({10, 11}), 1),
+        ("repeat_power", duration_type, frozenset({12, 13}), 1),
+        ("repeat_steps", duration_type, frozenset({6}), 1),
+        ("repeat_time", duration_type, frozenset({7}), 1000),
+        ("target_cadence_zone", target_type, frozenset({3}), 1),
+        ("target_hr_zone", target_type, frozenset({1}), 1),
+        ("target_power_zone", target_type, frozenset({4}), 1),
+        ("target_speed_zone", target_type, frozenset({0}), 1),
+        ("target_stroke_type", target_type, frozenset({11}), 1),
+    )),
+    5: Field("custom_target_value_low", base_type=uint32_type, subfields=(
+        ("custom_target_cadence_low", target_type, frozenset({3}), 1),
+        ("custom_target_heart_rate_low", target_type, frozenset({1}), 1),
+        ("custom_target_power_low", target_type, frozenset({4}), 1),
+        ("custom_target_speed_low", target_type, frozenset({0}), 1000),
+    )),
+    6: Field("custom_target_value_high", base_type=uint32_type, subfields=(
+        ("custom_target_cadence_high", target_type, frozenset({3}), 1),
+        ("custom_target_heart_rate_high", target_type, frozenset({1}), 1),
+        ("custom_target_power_high", target_type, frozenset({4}), 1),
+        ("custom_target_speed_high", target_type, frozenset({0}), 1000),
+    )),
+    7: Field("intensity", intensity, base_type=enum_type),
+    8: Field("notes", base_type=0x07),
+}
+
+profile = {
+    file_id_message: file_id_fields,
+    workout_message: workout_fields,
+    workout_step_message: workout_step_fields,
+}
+
+
+class Definition(NamedTuple):
+    global_number: int
+    size: int
+    # Unpacks the fields we read from a data message, the others are skipped over
+    layout: Optional[struct.Struct]
+    # Field number, base type and field of each value unpacked by `layout`
+    fields: Tuple[Tuple[int, int, Field], ...]
+
+
+def read_definition(data: memoryview, offset: int, developer_data: bool) -> Tuple[Definition, int]:
+    architecture, global_number, num_fields = struct.unpack_from("<xBHB", data, offset)
+    if architecture > 1:
+        raise FitError(f"Invalid architecture {architecture} at byte {offset}")
+    if architecture:
+        global_number = struct.unpack_from(">H", data, offset + 2)[0]
+    offset += 5
+    known = profile.get(global_number)
+    layout = [">" if architecture else "<"]
+    fields = []
+    size = 0
+    for _ in range(num_fields):
+        number, field_size, base_type = data[offset], data[offset + 1], data[offset + 2]
+        offset += 3
+        size += field_size
+        field = known.get(number) if known else None
+        value_format = base_types.get(base_type, ("",))[0]
+        if field is not None and base_type == string_type:
+            layout.append(f"{field_size}s")
+        elif field is not None and value_format and struct.calcsize(value_format) == field_size:
+            layout.append(value_format)
+        else:
+            # Arrays and fields we do not use
+            layout.append(f"{field_size}x")
+            continue
+        fields.append((number, base_type, field))
+    if developer_data:
+        num_developer_fields = data[offset]
+        offset += 1
+        size += sum(data[offset + 3 * n + 1] for n in range(num_developer_fields))
+        offset += 3 * num_developer_fields
+    definition = Definition(
+        global_number, size, struct.Struct("".join(layout)) if known else None, tuple(fields)
+    )
+    return definition, offset
+
+
+def read_message(definition: Definition, data: memoryview, offset: int) -> dict:
+    raw = {}
+    for (number, base_type, _), value in zip(definition.fields, definition.layout.unpack_from(data, offset)):
+        if base_type == string_type:
+            value = value.split(b"\0", 1)[0].decode("utf-8", errors="replace") or None
+        elif value == base_types[base_type][1]:
+            value = None
+        raw[number] = value
+
+    message = {}
+    for number, _, field in definition.fields:
+        value = raw[number]
+        name, enum, scale = field.name, field.enum, field.scale
+        for sub_name, ref_number, ref_values, sub_scale in field.subfields:
+            if raw.get(ref_number) in ref_values:
+                name, scale = sub_name, sub_scale
+                break
+        if value is not None:
+            if enum is not None:
+                value = enum.get(value, value)
+            elif scale != 1:
+                value = value / scale
+        message[name] = value
+    return message
+
+
+class Workout(NamedTuple):
+    name: Optional[str]
+    # Steps in the order of the file, as dicts of field name to value
+    steps: List[dict]
+
+
+def read_workout(data: bytes) -> Workout:
+    """Decodes the workout name and steps of a FIT file, raising `FitError` if the file is corrupt."""
+    data = memoryview(data)
+    if len(data) < 12:
+        raise FitError("File is too short")
+    header_size = data[0]
+    data_size = struct.unpack_from("<I", data, 4)[0]
+    if bytes(data[8:12]) != b".FIT":
+        raise FitError("Not a FIT file")
+    if header_size >= 14 and struct.unpack_from("<H", data, 12)[0] not in (0, crc16(data[:12])):
+        raise FitError("Header CRC mismatch")
+    end = header_size + data_size
+    if len(data) < end + 2:
+        raise FitError("File is truncated")
+    if crc16(data[: end + 2]) != 0:
+        raise FitError("File CRC mismatch")
+
+    name = None
+    steps = []
+    definitions: Dict[int, Definition] = {}
+    offset = header_size
+    while offset < end:
+        record_header = data[offset]
+        offset += 1
+        if record_header & 0x80:
+            # Compressed timestamp header, always a data message
+            local_type = (record_header >> 5) & 0x03
+        elif record_header & 0x40:
+            definition, offset = read_definition(data, offset, bool(record_header & 0x20))
+            definitions[record_header & 0x0F] = definition
+            continue
+        else:
+            local_type = record_header & 0x0F
+        definition = definitions.get(local_type)
+        if definition is None:
+            raise FitError(f"Data message with undefined local type {local_type} at byte {offset - 1}")
+        if definition.global_number == workout_step_message:
+            steps.append(read_message(definition, data, offset))
+        elif definition.global_number == workout_message and name is None:
+            name = read_message(definition, data, offset).get("wkt_name")
+        offset += definition.size
+    return Workout(name, steps)
+
+
+# Profile version written to the file header
+profile_version = 2132
+fit_epoch = datetime.datetime(1989, 12, 31, tzinfo=datetime.timezone.utc)
+
+
+def encode_messages(local_type: int, global_number: int, messages: List[dict]) -> bytes:
+    """
+    Encodes a definition and a data message for each message, which are dicts of field or subfield name to value
+    like those `read_message` returns. Missing and None values are written as invalid.
+    """
+    fields = profile[global_number]
+    names = {}
+    for number, field in fields.items():
+        names[field.name] = (number, field.scale)
+        for sub_name, _, _, sub_scale in field.subfields:
+            names[sub_name] = (number, sub_scale)
+
+    raw_messages = []
+    for message in messages:
+        raw = {}
+        for name, value in message.items():
+            if value is None:
+                continue
+            number, scale = names[name]
+            field = fields[number]
+            if field.base_type == string_type:
+                value = value.encode("utf-8")
+            elif field.enum is not None and isinstance(value, str):
+                value = {enum_name: enum_value for enum_value, enum_name in field.enum.items()}[value]
+            else:
+                value = round(value * scale)
+            raw[number] = value
+        raw_messages.append(raw)
+
+    numbers = sorted({number for raw in raw_messages for number in raw})
+    sizes, layout = {}, ["<"]
+    for number in numbers:
+        base_type = fields[number].base_type
+        if base_type == string_type:
+            # Strings are null terminated, and every message of a definition has the same size
+            sizes[number] = min(255, max(len(raw.get(number, b"")) for raw in raw_messages) + 1)
+            layout.append(f"{sizes[number]}s")
+        else:
+            layout.append(base_types[base_type][0])
+            sizes[number] = struct.calcsize(layout[-1])
+    data_layout = struct.Struct("".join(layout))
+
+    records = [struct.pack("<BBBHB", 0x40 | local_type, 0, 0, global_number, len(numbers))]
+    records.extend(struct.pack("BBB", number, sizes[number], fields[number].base_type) for number in numbers)
+    for raw in raw_messages:
+        values = []
+        for number in numbers:
+            base_type = fields[number].base_type
+            if base_type == string_type:
+                values.append(raw.get(number, b"")[: sizes[number] - 1])
+            else:
+                values.append(raw.get(number, base_types[base_type][1]))
+        records.append(bytes([local_type]) + data_layout.pack(*values))
+    return b"".join(records)
+
+
+def write_workout(name: str, steps: List[dict], created: Optional[datetime.datetime] = None) -> bytes:
+    """Encodes a running workout file, with steps as dicts like those `read_workout` returns."""
+    time_created = None
+    if created is not None:
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=datetime.timezone.utc)
+        time_created = int((created - fit_epoch).total_seconds())
+    records = b"".join((
+        encode_messages(0, file_id_message, [
+            {"type": "workout", "manufacturer": 255, "product": 0, "time_created": time_created}
+        ]),
+        encode_messages(1, workout_message, [
+            {"sport": "running", "num_valid_steps": len(steps), "wkt_name": name}
+        ]),
+        encode_messages(2, workout_step_message, [
+            {"message_index": index, **step} for index, step in enumerate(steps)
+        ]),
+    ))
+    header = struct.pack("<BBHI4s", 14, 0x20, profile_version, len(records), b".FIT")
+    data = header + struct.pack("<H", crc16(header)) + records
+    return data + struct.pack("<H", crc16(data))
@@ -0,0 +1,119 @@
+import datetime
+import json
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from loguru import logger
+
+from trainaspower import finalsurge, models, sessions
+
+# Config fields which do not change what a sync converts and uploads
+ignored_settings = {
+    "stryd_password",
+    "trainasone_password",
+    "finalsurge_password",
+    "number_of_workouts",
+    "trainasone_concurrency",
+    "stryd_concurrency",
+    "remember_logins",
+    "cache_ttl_days",
+    "cache_max_entries",
+    "watch_interval_minutes",
+    "resume_syncs",
+}
+
+
+class Journal:
+    """
+    The steps of today's sync finished for each workout date, so a failed sync can be resumed where it stopped.
+
+    A workout is `fetched` once its FIT steps are downloaded, `converted` once its steps are built and `uploaded`
+    once it is on Final Surge. The journal is written after every step and
+    removed when the sync succeeds. It is ignored when it is from another day or the config has changed, and a
+    date is started over when its workout on the TrainAsOne calendar has changed.
+    """
+
+    def __init__(self, path: Path, settings: str):
+        self.path = path
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+    @classmethod
+    def for_athlete(cls, directory: Path, config: models.Config) -> "Journal":
+        settings = finalsurge.content_hash(config.dict(exclude=ignored_settings))
+        return cls(directory / f"{sessions.athlete_key(config)}.json", settings)
+
+    def load(self) -> dict:
+        try:
+            saved = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.debug("Could not read the sync journal, starting over")
+            return {}
+        if saved.get("day") != datetime.date.today().isoformat() or saved.get("settings") != self.settings:
+            return {}
+        if saved["entries"]:
+            logger.info(f"Resuming the unfinished sync of {len(saved['entries'])} workout(s)")
+        return saved["entries"]
+
+    def write(self) -> None:
+        self.path.parent.mkdir(exist_ok=True)
+        temp_file = self.path.with_suffix(".tmp")
+        temp_file.write_text(
+            json.dumps({"day": datetime.date.today().isoformat(), "settings": self.settings, "entries": self.entries}),
+            encoding="utf-8",
+        )
+        os.replace(temp_file, self.path)
+
+    def entry(self, wo_date: Union[datetime.date, datetime.datetime], workout_id: str) -> dict:
+        entry = self.entries.get(finalsurge.as_date(wo_date).isoformat())
+        return entry if entry and entry["workout_id"] == workout_id else {}
+
+    def fetched(
+        self, wo_date: Union[datetime.date, datetime.datetime], workout_id: str
+    ) -> Optional[Tuple[models.Workout, Optional[List[dict]]]]:
+        """
+        Returns the furthest a workout got: the converted workout and None, the workout without its steps and its
+        FIT steps, or None if it has to be downloaded.
+        """
+        with self.lock:
+            entry = self.entry(wo_date, workout_id)
+        if not entry:
+            return None
+        return models.Workout.from_dict(entry["workout"]), entry.get("steps")
+
+    def record(self, wo_date: Union[datetime.date, datetime.datetime], workout_id: Optional[str], **entry) -> None:
+        key = finalsurge.as_date(wo_date).isoformat()
+        with self.lock:
+            if workout_id is None:
+                self.entries[key].update(entry)
+            else:
+                self.entries[key] = {"workout_id": workout_id, **entry}
+            self.write()
+
+    def record_fetched(self, workout_id: str, workout: models.Workout, steps: List[dict]) -> None:
+        self.record(workout.date, workout_id, stage="fetched", workout=workout.to_dict(), steps=steps)
+
+    def record_converted(self, workout_id: str, workout: models.Workout) -> None:
+        self.record(workout.date, workout_id, stage="converted", workout=workout.to_dict())
+
+    def uploaded(self, workout: models.Workout, payload_hash: str) -> bool:
+        """Whether the failed sync uploaded this exact workout."""
+        with self.lock:
+            entry = self.entries.get(finalsurge.as_date(workout.date).isoformat(), {})
+        return entry.get("stage") == "uploaded" and entry.get("payload_hash") == payload_hash
+
+    def record_uploaded(self, workout: models.Workout, payload_hash: str) -> None:
+        self.record(workout.date, None, stage="uploaded", payload_hash=payload_hash)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries = {}
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
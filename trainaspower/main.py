@@ -1,27 +1,32 @@
+# Imported first so the startup timings cover the remaining imports
+from trainaspower import timings  # isort: skip
+
 import argparse
 import datetime
+import functools
+import random
 import sys
-from itertools import islice
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby, islice
 from pathlib import Path
+from typing import Optional
 
 import yaml
 from loguru import logger
 from pydantic import ValidationError
 
-import trainaspower
-from trainaspower import finalsurge, models, stryd, trainasone
-
-if getattr(sys, "frozen", False):
-    directory = Path(sys.executable).parent
-else:
-    directory = Path(trainaspower.__file__).parent.parent
+from trainaspower import (
+    cache, export, finalsurge, journal, metrics, models, plans, stryd, syncing, trainasone, transport
+)
 
 
 def setup_logging():
     logger.remove()
     logger.add(sys.stderr, level="INFO")
     logger.add(
-        directory / "trainaspower.log",
+        syncing.directory / "trainaspower.log",
         level="DEBUG",
         rotation="3 days",
         retention="6 days",
@@ -30,78 +35,452 @@ def setup_logging():
     )
 
 
-def load_config(config_file):
+def load_configs(config_file) -> list[models.Config]:
+    """Loads the config file, which holds either one athlete's config or a list of them for a batch sync."""
     try:
         raw_config = yaml.safe_load(config_file)
     except yaml.YAMLError:
         logger.exception("Error parsing YAML from config.yaml")
         raise
 
+    raw_configs = raw_config if isinstance(raw_config, list) else [raw_config]
     try:
-        config = models.Config(**raw_config)
+        configs = [models.Config(**raw) for raw in raw_configs]
     except ValidationError as exc:
         logger.error(str(exc))
         raise
 
-    return config
+    return configs
+
+
+def sync(config: models.Config) -> Counter:
+    """Syncs the upcoming TrainAsOne workouts of one athlete to Final Surge, and returns what was changed."""
+    tao_client = trainasone.TrainAsOne()
+    finalsurge_client = finalsurge.FinalSurge()
+    stryd_client = stryd.Stryd(config.stryd_concurrency)
+    syncing.login(config, tao_client, finalsurge_client, stryd_client)
+    timings.mark("logins")
+    sync_journal = syncing.open_journal(config)
+    try:
+        results = sync_workouts(config, tao_client, finalsurge_client, stryd_client, sync_journal)
+        if sync_journal:
+            sync_journal.clear()
+        return results
+    finally:
+        # Sessions may have been renewed during the sync
+        syncing.save_sessions(config, tao_client, finalsurge_client, stryd_client)
+
+
+def sync_workouts(
+    config: models.Config,
+    tao_client: trainasone.TrainAsOne,
+    finalsurge_client: finalsurge.FinalSurge,
+    stryd_client: stryd.Stryd,
+    sync_journal: Optional[journal.Journal] = None,
+) -> Counter:
+    syncing.load_pace_conversion(config, stryd_client)
+    start_date = datetime.date.today()
+    results = Counter()
+    synced, cleared = [], []
+    for wo in islice(
+        tao_client.get_next_workouts(config, stryd_client, sync_journal), config.number_of_workouts
+    ):
+        # Clear any cancelled workouts
+        with timings.phase("upload"):
+            for wo_date in syncing.daterange(start_date, wo.date):
+                if finalsurge_client.remove_workout(wo_date):
+                    results["deleted"] += 1
+                cleared.append(wo_date)
+            # Add the new workout
+            results[syncing.upload_workout(finalsurge_client, wo, sync_journal)] += 1
+        synced.append(wo)
+        start_date = wo.date + datetime.timedelta(1)
+    syncing.store_plan(config, synced, cleared)
+    timings.mark("sync")
+    return results
+
+
+def reapply(config: models.Config) -> Counter:
+    """
+    Uploads the workouts stored by the last sync again with the current `power_adjust`, without any TrainAsOne or
+    Stryd requests.
+    """
+    workouts = plans.store.load(config) if plans.store is not None else []
+    if not workouts:
+        logger.warning(f"No upcoming workouts are stored for {config.trainasone_email}, run a sync first")
+        return Counter()
+    finalsurge_client = finalsurge.FinalSurge()
+    saved = syncing.session_store.load(config) if config.remember_logins else {}
+    syncing.login_service(
+        "finalsurge", finalsurge_client, config.finalsurge_email, config.finalsurge_password, saved
+    )
+    results = Counter()
+    try:
+        finalsurge_client.index_workouts(datetime.date.today(), finalsurge.as_date(workouts[-1].date))
+        with timings.phase("upload"):
+            for wo in workouts:
+                wo.steps = trainasone.apply_power_adjust(wo.unadjusted_steps, config.power_adjust)
+                results[finalsurge_client.add_workout(wo)] += 1
+    finally:
+        if config.remember_logins:
+            syncing.session_store.save(config, {**saved, "finalsurge": finalsurge_client.session_state()})
+    return results
+
+
+# Calendar days converted at a time by `export_workouts`, so at most that many downloads are held in memory
+export_batch_days = 7
+
+
+def export_workouts(config: models.Config, writer, days: Optional[int] = None, prefix: str = "") -> int:
+    """
+    Converts the upcoming workouts, the next `number_of_workouts` or those of the next `days` days, and writes each
+    with `writer` as soon as it is converted, without any Final Surge requests. Returns how many were written.
+    """
+    tao_client = trainasone.TrainAsOne()
+    stryd_client = stryd.Stryd(config.stryd_concurrency)
+    saved = syncing.session_store.load(config) if config.remember_logins else {}
+    with timings.phase("login"):
+        for name, client, email, password in (
+            ("trainasone", tao_client, config.trainasone_email, config.trainasone_password),
+            ("stryd", stryd_client, config.stryd_email, config.stryd_password),
+        ):
+            syncing.login_service(name, client, email, password, saved)
+    try:
+        syncing.load_pace_conversion(config, stryd_client)
+        calendar = tao_client.get_calendar()
+        today = datetime.date.today()
+        if days is None:
+            calendar = calendar[: config.number_of_workouts]
+        else:
+            end_date = today + datetime.timedelta(days)
+            calendar = [(wo_date, url) for wo_date, url in calendar if finalsurge.as_date(wo_date) < end_date]
+        exported = 0
+        for _, batch in groupby(
+            calendar, key=lambda day: (finalsurge.as_date(day[0]) - today).days // export_batch_days
+        ):
+            for wo in tao_client.get_workouts(list(batch), config, stryd_client):
+                writer.write(wo, prefix)
+                exported += 1
+        return exported
+    finally:
+        if config.remember_logins:
+            syncing.session_store.save(config, {
+                **saved, "trainasone": tao_client.session_state(), "stryd": stryd_client.session_state()
+            })
+
+
+def watch(config: models.Config, stop: threading.Event) -> None:
+    """
+    Keeps one athlete's Final Surge calendar in sync until `stop` is set.
+
+    The TrainAsOne calendar is checked about every `watch_interval_minutes`, and only the days whose workout has
+    changed since the last check are converted and uploaded again. Logins and caches are kept between checks, and
+    everything is checked again once a day to pick up changes on Stryd.
+    """
+    tao_client = trainasone.TrainAsOne()
+    finalsurge_client = finalsurge.FinalSurge()
+    stryd_client = stryd.Stryd(config.stryd_concurrency)
+    syncing.login(config, tao_client, finalsurge_client, stryd_client)
+    # Workout id and url of each calendar day as of the last check
+    fingerprints: dict[datetime.date, tuple[str, str]] = {}
+    today = None
+    while not stop.is_set():
+        success = False
+        try:
+            if today != datetime.date.today():
+                today = datetime.date.today()
+                fingerprints.clear()
+                finalsurge_client.workout_index.clear()
+                stryd_client.reset_caches()
+                if cache.store is not None:
+                    # Entries past their age or over `cache_max_entries` are otherwise only dropped on start and exit
+                    cache.store.evict()
+                syncing.load_pace_conversion(config, stryd_client)
+            results = sync_changed_days(config, tao_client, finalsurge_client, stryd_client, fingerprints)
+            if results:
+                logger.info(f"Final Surge sync complete: {syncing.format_results(results)}")
+            success = True
+        except trainasone.FindWorkoutException as exc:
+            filename = syncing.write_debug_file(exc, prefix=f"{config.trainasone_email}-")
+            logger.error(f"Could not load Train as One workouts. Created {filename} for debugging.")
+        except Exception:
+            logger.exception(f"Sync failed for {config.trainasone_email}, trying again at the next check")
+        finally:
+            syncing.save_sessions(config, tao_client, finalsurge_client, stryd_client)
+            try:
+                metrics.export(success)
+            except Exception:
+                logger.exception("Could not write the metrics, trying again after the next check")
+        # Spread the checks out so several athletes or instances do not all hit TrainAsOne at once
+        stop.wait(config.watch_interval_minutes * 60 * random.uniform(0.8, 1.2))
+
+
+def sync_changed_days(
+    config: models.Config,
+    tao_client: trainasone.TrainAsOne,
+    finalsurge_client: finalsurge.FinalSurge,
+    stryd_client: stryd.Stryd,
+    fingerprints: dict[datetime.date, tuple[str, str]],
+) -> Counter:
+    """Syncs the days of the TrainAsOne calendar which differ from `fingerprints`, and updates them."""
+    calendar = tao_client.get_calendar()[: config.number_of_workouts]
+    current = {
+        finalsurge.as_date(wo_date): (trainasone.workout_id_from_url(workout_url), workout_url)
+        for wo_date, workout_url in calendar
+    }
+    results = Counter()
+    today = datetime.date.today()
+    # Days synced at an earlier check can be later than any day left on the calendar
+    last_day = max([*current, *fingerprints], default=today)
+    if (current or fingerprints) and today not in finalsurge_client.workout_index:
+        # Load the Final Surge workouts of every day we may touch with a single request
+        finalsurge_client.index_workouts(today, last_day)
+    removed = [
+        wo_date
+        for wo_date in syncing.daterange(today, last_day + datetime.timedelta(1))
+        if wo_date not in current and (wo_date < max(current, default=today) or wo_date in fingerprints)
+    ]
+    # Clear any cancelled workouts
+    with timings.phase("upload"):
+        for wo_date in removed:
+            if finalsurge_client.remove_workout(wo_date):
+                results["deleted"] += 1
+    for wo_date in list(fingerprints):
+        if wo_date not in current:
+            del fingerprints[wo_date]
+
+    changed = [
+        (wo_date, workout_url)
+        for wo_date, workout_url in calendar
+        if fingerprints.get(finalsurge.as_date(wo_date)) != current[finalsurge.as_date(wo_date)]
+    ]
+    if not changed:
+        logger.debug("TrainAsOne calendar is unchanged")
+        syncing.store_plan(config, [], removed)
+        return results
+    logger.info(f"{len(changed)} day(s) changed on the TrainAsOne calendar")
+    synced = []
+    for wo in tao_client.get_workouts(changed, config, stryd_client):
+        with timings.phase("upload"):
+            results[finalsurge_client.add_workout(wo)] += 1
+        wo_date = finalsurge.as_date(wo.date)
+        fingerprints[wo_date] = current[wo_date]
+        synced.append(wo)
+    syncing.store_plan(config, synced, removed)
+    return results
+
+
+def watch_all(configs: list[models.Config], workers: int) -> None:
+    """Watches every athlete on a thread pool until interrupted."""
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(config, pool.submit(watch, config, stop)) for config in configs]
+        try:
+            for config, future in futures:
+                try:
+                    future.result()
+                except Exception as exc:
+                    logger.opt(exception=exc).error(f"Stopped watching {config.trainasone_email}")
+        except KeyboardInterrupt:
+            logger.info("Stopping")
+            stop.set()
 
 
-def daterange(start_date: datetime.date, end_date: datetime.date):
-    if isinstance(start_date, datetime.datetime):
-        start_date = start_date.date()
-    if isinstance(end_date, datetime.datetime):
-        end_date = end_date.date()
-    for n in range(int((end_date - start_date).days)):
-        yield start_date + datetime.timedelta(n)
+def sync_batch(configs: list[models.Config], workers: int, sync_one=sync) -> bool:
+    """
+    Syncs every athlete on a thread pool, with `sync_one`. A failure only affects that athlete. Returns whether all
+    succeeded.
+    """
+
+    def sync_athlete(config: models.Config) -> Counter:
+        logger.info(f"Syncing athlete {config.trainasone_email}")
+        try:
+            return sync_one(config)
+        except trainasone.FindWorkoutException as exc:
+            raise syncing.batch_failure(config, exc) from exc
+
+    outcomes = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(sync_athlete, config) for config in configs]
+        for future in futures:
+            try:
+                outcomes.append(future.result())
+            except Exception as exc:
+                outcomes.append(exc)
+    return syncing.log_batch_summary(configs, outcomes)
+
+
+commands = ("sync", "watch", "reapply", "export")
 
 
 @logger.catch
 def main():
+    timings.mark("imports")
     setup_logging()
 
-    config_file_default_path = directory / "config.yaml"
+    config_file_default_path = syncing.directory / "config.yaml"
 
     parser = argparse.ArgumentParser(
         description="Create power based structured workouts from TrainAsOne data"
     )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="sync",
+        help="`sync` (the default) syncs the upcoming workouts once, "
+        "`watch` keeps running and syncs days whenever they change on TrainAsOne, "
+        "`reapply` uploads the workouts of the last sync again with the current power_adjust, "
+        "`export` writes the converted workouts to --output instead of Final Surge",
+    )
     parser.add_argument(
         "config_file",
-        type=argparse.FileType("r"),
         nargs="?",
         default=str(config_file_default_path),
         help=f"Path to config.yaml, defaults to '{config_file_default_path}'",
     )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Log how long startup and each phase of the sync took",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="How many athletes to sync at the same time when the config file lists several",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Sync with asyncio, overlapping the requests of every workout, service and athlete",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=Path,
+        metavar="DIR",
+        help="Write request and phase metrics of the run to this directory, "
+        "as trainaspower_metrics.json and trainaspower.prom for the Prometheus textfile collector",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        metavar="PATH",
+        help="Where `export` writes the workouts: a directory of Final Surge JSON and FIT files, "
+        "or a .jsonl file, or a .tar or .tar.gz archive",
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        help="Export the workouts of this many days instead of the next number_of_workouts",
+    )
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument(
+        "--record",
+        type=Path,
+        metavar="CASSETTE",
+        help="Save every request and response of the sync to this file",
+    )
+    cassette.add_argument(
+        "--replay",
+        type=Path,
+        metavar="CASSETTE",
+        help="Answer requests from a file saved with --record instead of the real services",
+    )
+    parser.add_argument(
+        "--replay-delay",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="Simulated latency of each replayed request",
+    )
     args = parser.parse_args()
+    if args.command not in commands:
+        # The command can be left out, `trainaspower config.yaml` is a sync
+        if args.config_file != str(config_file_default_path):
+            parser.error(f"unknown command '{args.command}', choose from {', '.join(commands)}")
+        args.command, args.config_file = "sync", args.command
+    if args.command == "export" and args.output is None:
+        parser.error("export needs --output")
+    try:
+        args.config_file = argparse.FileType("r")(args.config_file)
+    except argparse.ArgumentTypeError as exc:
+        parser.error(str(exc))
 
     try:
-        config = load_config(args.config_file)
+        configs = load_configs(args.config_file)
     except Exception:
         sys.exit(1)
     finally:
         args.config_file.close()
+    timings.mark("config")
 
-    trainasone.login(config.trainasone_email, config.trainasone_password)
-    finalsurge.login(config.finalsurge_email, config.finalsurge_password)
-    stryd.login(config.stryd_email, config.stryd_password)
-    start_date = datetime.date.today()
+    metrics.export_dir = args.metrics
+    if args.record or args.replay:
+        # Make the same requests on every run, without saved logins, journals, cached conversions or spot checks
+        for config in configs:
+            config.remember_logins = False
+            config.resume_syncs = False
+        random.seed(0)
+        if args.record:
+            transport.start_recording(args.record)
+        else:
+            transport.start_replay(args.replay, args.replay_delay)
+    else:
+        # The cache is shared by every athlete, the first config decides its limits
+        cache.open_store(
+            syncing.directory / "trainaspower_cache.sqlite",
+            ttl=datetime.timedelta(days=configs[0].cache_ttl_days),
+            max_entries=configs[0].cache_max_entries,
+        )
+        plans.open_store(syncing.directory / "trainaspower_plans")
+    sync_one, sync_all = sync, sync_batch
+    if args.command == "reapply":
+        sync_one, sync_all = reapply, functools.partial(sync_batch, sync_one=reapply)
+    elif args.use_async:
+        from trainaspower import aio
+
+        sync_one, sync_all = aio.run_sync, aio.run_batch
+    success = False
     try:
-        for wo in islice(
-            trainasone.get_next_workouts(config), config.number_of_workouts
-        ):
-            # Clear any cancelled workouts
-            for wo_date in daterange(start_date, wo.date):
-                finalsurge.remove_workout(wo_date)
-            # Add the new workout
-            finalsurge.add_workout(wo)
-            start_date = wo.date + datetime.timedelta(1)
+        if args.command == "watch":
+            watch_all(configs, args.workers)
+            success = True
+            return
+        if args.command == "export":
+            writer = export.open_export(args.output)
+            try:
+                for config in configs:
+                    # Each athlete gets their own folder when there are several
+                    prefix = f"{config.trainasone_email}/" if len(configs) > 1 else ""
+                    exported = export_workouts(config, writer, args.days, prefix)
+                    logger.info(f"Exported {exported} workouts of {config.trainasone_email} to {args.output}")
+            finally:
+                writer.close()
+            success = True
+            return
+        if len(configs) > 1:
+            success = sync_all(configs, args.workers)
+            if not success:
+                sys.exit(1)
+            return
+        results = sync_one(configs[0])
+        logger.info(f"Final Surge sync complete: {syncing.format_results(results)}")
+        success = True
     except trainasone.FindWorkoutException as exc:
-        with open(directory / exc.filename, "w", encoding="utf-8") as f:
-            f.write(exc.html)
+        filename = syncing.write_debug_file(exc)
         logger.opt(exception=True).debug("Error")
         logger.error(
-            f"Could not load next Train as One workout. Created {exc.filename} for debugging."
+            f"Could not load next Train as One workout. Created {filename} for debugging."
         )
         sys.exit(1)
+    finally:
+        cache.close_store()
+        plans.close_store()
+        transport.stop()
+        metrics.export(success)
+        if args.timings:
+            timings.report()
 
 
 if __name__ == "__main__":
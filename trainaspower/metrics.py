@@ -0,0 +1,154 @@
+"""Request metrics for each service endpoint, exported with the phase timings at the end of a run."""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from trainaspower import timings
+
+# Path segments which identify a single user or workout, so their requests are counted under one endpoint
+id_segment = re.compile(r"^(\d+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})$", re.IGNORECASE)
+
+
+class EndpointStats:
+    __slots__ = ("count", "seconds", "max_seconds", "bytes", "statuses")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+        self.statuses = Counter()
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "seconds": round(self.seconds, 6),
+            "max_seconds": round(self.max_seconds, 6),
+            "bytes": self.bytes,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+        }
+
+
+# Stats by host, method and endpoint path
+endpoints: Dict[Tuple[str, str, str], EndpointStats] = {}
+endpoints_lock = threading.Lock()
+started = time.time()
+
+# Where `export` writes the metrics, nothing is written when it is not set
+export_dir: Optional[Path] = None
+
+
+def endpoint(url: str) -> Tuple[str, str]:
+    parts = urlsplit(url)
+    path = "/".join("{id}" if id_segment.match(segment) else segment for segment in parts.path.split("/"))
+    return parts.netloc, path or "/"
+
+
+def record_response(response: requests.Response, *args, **kwargs) -> None:
+    """Response hook which counts every request made by a session."""
+    host, path = endpoint(response.request.url)
+    seconds = response.elapsed.total_seconds()
+    with endpoints_lock:
+        stats = endpoints.setdefault((host, response.request.method, path), EndpointStats())
+        stats.count += 1
+        stats.seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.bytes += len(response.content)
+        stats.statuses[response.status_code] += 1
+
+
+def summary(success: bool) -> dict:
+    with endpoints_lock:
+        requests_summary = [
+            {"host": host, "method": method, "endpoint": path, **stats.as_dict()}
+            for (host, method, path), stats in sorted(endpoints.items())
+        ]
+    with timings.phases_lock:
+        phases = {
+            name: {"seconds": round(total, 6), "count": count}
+            for name, (total, count) in timings.phases.items()
+        }
+    return {
+        "started": started,
+        "duration": round(time.time() - started, 6),
+        "success": success,
+        "startup": {name: round(elapsed, 6) for name, elapsed in timings.marks.items()},
+        "phases": phases,
+        "requests": requests_summary,
+    }
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def prometheus_text(run: dict) -> str:
+    """Formats a run summary for the Prometheus node exporter textfile collector."""
+    metrics = {
+        "trainaspower_last_run_timestamp_seconds": ("Time the last run started", [("", run["started"])]),
+        "trainaspower_last_run_duration_seconds": ("How long the last run took", [("", run["duration"])]),
+        "trainaspower_last_run_success": ("Whether the last run succeeded", [("", int(run["success"]))]),
+        "trainaspower_phase_seconds": ("Time spent in each phase of the last run", []),
+        "trainaspower_phase_count": ("How many times each phase ran in the last run", []),
+        "trainaspower_http_requests": ("Requests made to each endpoint in the last run", []),
+        "trainaspower_http_request_seconds": ("Total latency of each endpoint in the last run", []),
+        "trainaspower_http_request_max_seconds": ("Slowest request to each endpoint in the last run", []),
+        "trainaspower_http_response_bytes": ("Bytes received from each endpoint in the last run", []),
+    }
+    for name, phase in run["phases"].items():
+        labels = f'{{phase="{escape_label(name)}"}}'
+        metrics["trainaspower_phase_seconds"][1].append((labels, phase["seconds"]))
+        metrics["trainaspower_phase_count"][1].append((labels, phase["count"]))
+    for stats in run["requests"]:
+        labels = ",".join(
+            f'{label}="{escape_label(stats[label])}"' for label in ("host", "method", "endpoint")
+        )
+        for status, count in stats["statuses"].items():
+            metrics["trainaspower_http_requests"][1].append((f'{{{labels},status="{status}"}}', count))
+        metrics["trainaspower_http_request_seconds"][1].append((f"{{{labels}}}", stats["seconds"]))
+        metrics["trainaspower_http_request_max_seconds"][1].append((f"{{{labels}}}", stats["max_seconds"]))
+        metrics["trainaspower_http_response_bytes"][1].append((f"{{{labels}}}", stats["bytes"]))
+
+    lines = []
+    for name, (help_text, samples) in metrics.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f"{name}{labels} {value}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+# Several watch threads export after each of their checks
+export_lock = threading.Lock()
+
+
+def write_atomic(path: Path, text: str) -> None:
+    # The textfile collector may read the file at any time, so it must never see it half written
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False
+    ) as temp_file:
+        temp_file.write(text)
+    try:
+        os.replace(temp_file.name, path)
+    except OSError:
+        os.unlink(temp_file.name)
+        raise
+
+
+def export(success: bool = True) -> None:
+    """Writes the run summary as `trainaspower_metrics.json` and `trainaspower.prom` to `export_dir`."""
+    if export_dir is None:
+        return
+    with export_lock:
+        run = summary(success)
+        export_dir.mkdir(parents=True, exist_ok=True)
+        write_atomic(export_dir / "trainaspower_metrics.json", json.dumps(run, indent=2))
+        write_atomic(export_dir / "trainaspower.prom", prometheus_text(run))
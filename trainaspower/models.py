@@ -1,18 +1,44 @@
 import builtins
 import datetime
+import re
+import threading
 from dataclasses import dataclass
-from typing import List, NamedTuple, Union, Tuple, Any, Optional
+from typing import List, NamedTuple, Union, Tuple, Any, Optional, Literal, TYPE_CHECKING
 
 from loguru import logger
-from pint import UnitRegistry, Quantity
 from pydantic import BaseModel, Field, validator
 
-ureg = UnitRegistry()
-mile = ureg.mile
-kilometer = ureg.kilometer
-meter = ureg.meter
-second = ureg.second
-minute = ureg.minute
+if TYPE_CHECKING:
+    from pint import UnitRegistry
+
+unit_names = ("mile", "kilometer", "meter", "second", "minute")
+
+unit_registry: Optional["UnitRegistry"] = None
+unit_registry_lock = threading.Lock()
+
+
+def get_unit_registry() -> "UnitRegistry":
+    global unit_registry
+    # Workouts are converted on several threads, which must all share one registry
+    with unit_registry_lock:
+        if unit_registry is None:
+            from pint import UnitRegistry
+
+            unit_registry = UnitRegistry()
+        return unit_registry
+
+
+def __getattr__(name):
+    # Building the unit registry is slow, so `ureg`, `Quantity` and the units are only loaded when first used
+    if name == "ureg":
+        return get_unit_registry()
+    if name in unit_names:
+        return getattr(get_unit_registry(), name)
+    if name == "Quantity":
+        from pint import Quantity
+
+        return Quantity
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Config(BaseModel):
@@ -26,6 +52,21 @@ class Config(BaseModel):
     number_of_workouts: int = 1
     include_runback_step: bool = False
     pace_only: bool = False
+    workout_details_from_fit: bool = False
+    # Unit of the planned distance on Final Surge when `workout_details_from_fit` is on
+    distance_unit: Literal["km", "mi"] = "km"
+    trainasone_concurrency: int = 2
+    stryd_concurrency: int = 4
+    pace_conversion: Literal["stryd", "model", "table"] = "stryd"
+    model_error_bound: float = 3
+    model_spot_checks: int = 2
+    # Fastest and slowest pace (min/km) in the pace to power table
+    pace_table_range: Tuple[str, str] = ("2:30", "12:00")
+    remember_logins: bool = True
+    cache_ttl_days: float = 30
+    cache_max_entries: int = 20000
+    watch_interval_minutes: float = 15
+    resume_syncs: bool = True
     # Old config values
     recovery_pace_adjust: Any = Field(removed='Field `power_adjust` has been added instead')
     very_easy_pace_adjust: Any = Field(removed='Field `power_adjust` has been added instead')
@@ -43,6 +84,13 @@ class Config(BaseModel):
             logger.warning(message)
         return v
 
+    @validator('pace_table_range')
+    def check_pace_table_range(cls, v):
+        for pace in v:
+            if not re.fullmatch(r'\d+:[0-5]\d', pace):
+                raise ValueError(f'`{pace}` is not a pace like 4:30')
+        return v
+
     class Config:
         extra = 'forbid'
 
@@ -65,33 +113,105 @@ class PowerRange:
         return new
 
 
+# Workouts and steps hold plain floats in SI units, pint is only used when parsing and displaying them
+meters_per_unit = {"m": 1.0, "km": 1000.0, "mi": 1609.344}
+
+
 class PaceRange(NamedTuple):
-    min: Quantity
-    max: Quantity
+    # Seconds per meter
+    min: float
+    max: float
 
 
 class Workout:
+    __slots__ = (
+        "name", "description", "steps", "unadjusted_steps", "date", "id", "duration", "distance", "distance_unit",
+        "source_hash",
+    )
     name: str
     description: str
     steps: List["Step"]
+    # The steps before `power_adjust` was added to their power ranges
+    unadjusted_steps: List["Step"]
     date: datetime.date
     id: str
-    duration: Quantity
-    distance: Quantity
+    # Seconds
+    duration: float
+    # Meters
+    distance: float
+    # Unit the distance is displayed in, one of `meters_per_unit`
+    distance_unit: str
+    # Hash of the TrainAsOne FIT file the steps are converted from
+    source_hash: str
+
+    def to_dict(self) -> dict:
+        """JSON serializable copy of the workout, which `from_dict` turns back into a workout."""
+        data = {name: getattr(self, name) for name in self.__slots__ if hasattr(self, name)}
+        if "date" in data:
+            data["date"] = self.date.isoformat()
+        for name in ("steps", "unadjusted_steps"):
+            if name in data:
+                data[name] = [step.to_dict() for step in data[name]]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Workout":
+        workout = cls()
+        for name, value in data.items():
+            setattr(workout, name, value)
+        if "date" in data:
+            date_type = datetime.datetime if "T" in data["date"] else datetime.date
+            workout.date = date_type.fromisoformat(data["date"])
+        for name in ("steps", "unadjusted_steps"):
+            if name in data:
+                setattr(workout, name, [Step.from_dict(step) for step in data[name]])
+        return workout
 
 
 class Step:
+    __slots__ = ("description", "type")
     description: str
     type: str
 
+    @staticmethod
+    def from_dict(data: dict) -> "Step":
+        if data["kind"] == "repeat":
+            step = RepeatStep(data["repetitions"])
+            step.steps = [Step.from_dict(s) for s in data["steps"]]
+        else:
+            step = ConcreteStep()
+            step.power_range = PowerRange(*data["power_range"]) if data["power_range"] else None
+            step.pace_range = PaceRange(*data["pace_range"]) if data["pace_range"] else None
+            step.length = data["length"]
+            step.length_type = data["length_type"]
+        step.description = data["description"]
+        step.type = data["type"]
+        return step
+
 
 class ConcreteStep(Step):
+    __slots__ = ("power_range", "pace_range", "length", "length_type")
     power_range: PowerRange
     pace_range: PaceRange
-    length: Optional[Quantity]
+    # Seconds or meters, depending on `length_type`
+    length: Optional[float]
+    # `time`, `distance`, or None for open steps
+    length_type: Optional[str]
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": "concrete",
+            "description": self.description,
+            "type": self.type,
+            "power_range": [self.power_range.min, self.power_range.max] if self.power_range else None,
+            "pace_range": list(self.pace_range) if self.pace_range else None,
+            "length": self.length,
+            "length_type": self.length_type,
+        }
 
 
 class RepeatStep(Step):
+    __slots__ = ("repetitions", "steps")
     repetitions: int
     steps: List["Step"]
 
@@ -100,3 +220,12 @@ class RepeatStep(Step):
         self.description = f"Repeat the following steps {repetitions} time{'s' if repetitions>1 else ''}."
         self.repetitions = repetitions
         self.type = "REPEAT"
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": "repeat",
+            "description": self.description,
+            "type": self.type,
+            "repetitions": self.repetitions,
+            "steps": [step.to_dict() for step in self.steps],
+        }
@@ -0,0 +1,77 @@
+import math
+import mmap
+import os
+import struct
+from datetime import date
+from pathlib import Path
+from typing import Callable, Optional
+
+# Magic, version, first seconds per mile, number of paces, date built (ordinal), critical power, Stryd params hash
+header = struct.Struct("<4sHxxiiid16s")
+magic = b"TAPT"
+version = 1
+
+
+class PaceTable:
+    """
+    Power for every whole second per mile pace between two paces, read from a memory mapped file.
+
+    Tables are built at most once a day per athlete, and shared by every process through the file.
+    """
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            file_magic, file_version, self.first, self.count, built, self.critical_power, params_hash
+        ) = header.unpack_from(self.map)
+        if file_magic != magic or file_version != version:
+            raise ValueError(f"{path} is not a pace table")
+        if len(self.map) != header.size + 8 * self.count:
+            raise ValueError(f"{path} is truncated")
+        self.built = date.fromordinal(built)
+        self.params_hash = params_hash.rstrip(b"\0").decode("ascii")
+        self.powers = memoryview(self.map)[header.size:].cast("d")
+
+    def matches(self, first: int, last: int, critical_power: float, params_hash: str) -> bool:
+        """Whether the table was built today, for the same band, fitness and calculator settings."""
+        return (
+            self.built == date.today()
+            and (self.first, self.count) == (first, last - first + 1)
+            and self.critical_power == critical_power
+            and self.params_hash == params_hash
+        )
+
+    def get(self, seconds: int) -> Optional[float]:
+        """Power for a pace in seconds per mile, or None if it is outside the table."""
+        index = seconds - self.first
+        if not 0 <= index < self.count:
+            return None
+        power = self.powers[index]
+        return None if math.isnan(power) else power
+
+
+def build(
+    path: Path,
+    first: int,
+    last: int,
+    critical_power: float,
+    params_hash: str,
+    powers: Callable[[range], list],
+) -> PaceTable:
+    """Writes a table of `powers(range(first, last + 1))` to `path` and opens it."""
+    values = powers(range(first, last + 1))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temp_file, "wb") as f:
+        f.write(header.pack(
+            magic, version, first, len(values), date.today().toordinal(), critical_power, params_hash.encode("ascii")
+        ))
+        f.write(struct.pack(f"<{len(values)}d", *(math.nan if v is None else v for v in values)))
+    try:
+        # Other processes keep reading their old table until they open the new one
+        os.replace(temp_file, path)
+    except PermissionError:
+        # Windows does not allow replacing a file another process has mapped, use ours until the next build
+        return PaceTable(temp_file)
+    return PaceTable(path)
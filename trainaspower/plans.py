@@ -0,0 +1,69 @@
+import datetime
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from loguru import logger
+
+from trainaspower import finalsurge, models, sessions
+
+
+class PlanStore:
+    """
+    Keeps each athlete's upcoming converted workouts, with their power ranges before `power_adjust`, so they can
+    be uploaded again with another adjustment without asking TrainAsOne or Stryd.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def athlete_file(self, config: models.Config) -> Path:
+        return self.path / f"{sessions.athlete_key(config)}.json"
+
+    def read(self, config: models.Config) -> dict:
+        try:
+            return json.loads(self.athlete_file(config).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.debug("Could not read the stored workouts, they will be stored again")
+            return {}
+
+    def load(self, config: models.Config) -> List[models.Workout]:
+        """The stored workouts from today on, in date order."""
+        today = datetime.date.today().isoformat()
+        saved = self.read(config)
+        return [models.Workout.from_dict(saved[day]) for day in sorted(saved) if day >= today]
+
+    def update(
+        self, config: models.Config, workouts: Iterable[models.Workout], removed: Iterable[datetime.date] = ()
+    ) -> None:
+        """Stores the workouts, replacing those of the same days, and forgets the days in `removed`."""
+        today = datetime.date.today().isoformat()
+        with self.lock:
+            saved = {day: workout for day, workout in self.read(config).items() if day >= today}
+            for day in removed:
+                saved.pop(finalsurge.as_date(day).isoformat(), None)
+            for workout in workouts:
+                saved[finalsurge.as_date(workout.date).isoformat()] = workout.to_dict()
+            self.path.mkdir(exist_ok=True)
+            athlete_file = self.athlete_file(config)
+            temp_file = athlete_file.with_suffix(".tmp")
+            temp_file.write_text(json.dumps(saved), encoding="utf-8")
+            os.replace(temp_file, athlete_file)
+
+
+store: Optional[PlanStore] = None
+
+
+def open_store(path: Path) -> None:
+    global store
+    store = PlanStore(path)
+
+
+def close_store() -> None:
+    global store
+    store = None
@@ -0,0 +1,69 @@
+import base64
+import hashlib
+import json
+import os
+import secrets
+from pathlib import Path
+
+from cryptography.fernet import Fernet, InvalidToken
+from loguru import logger
+
+from trainaspower import models
+
+
+def athlete_key(config: models.Config) -> str:
+    """Short id of an athlete's accounts, used to name the files kept for them."""
+    emails = "\0".join((config.trainasone_email, config.finalsurge_email, config.stryd_email))
+    return hashlib.sha256(emails.encode("utf-8")).hexdigest()[:16]
+
+
+class SessionStore:
+    """
+    Keeps login tokens and cookies between runs, so each run does not have to log in to every service again.
+
+    Each athlete's sessions are saved in their own file, encrypted with a key derived from the athlete's passwords.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def athlete_file(self, config: models.Config) -> Path:
+        return self.path / f"{athlete_key(config)}.json"
+
+    @staticmethod
+    def fernet(config: models.Config, salt: bytes) -> Fernet:
+        secret = "\0".join((
+            config.trainasone_email,
+            config.trainasone_password,
+            config.finalsurge_email,
+            config.finalsurge_password,
+            config.stryd_email,
+            config.stryd_password,
+        ))
+        key = hashlib.pbkdf2_hmac("sha256", secret.encode("utf-8"), salt, 200_000)
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    def load(self, config: models.Config) -> dict:
+        """Returns the saved session state of each service, or an empty dict if there is none we can use."""
+        try:
+            saved = json.loads(self.athlete_file(config).read_text(encoding="utf-8"))
+            salt = base64.b64decode(saved["salt"])
+            return json.loads(self.fernet(config, salt).decrypt(saved["token"].encode("ascii")))
+        except FileNotFoundError:
+            return {}
+        except (InvalidToken, ValueError, KeyError):
+            # Most likely a password was changed, log in again and overwrite it
+            logger.debug("Could not read saved login sessions, logging in again")
+            return {}
+
+    def save(self, config: models.Config, state: dict) -> None:
+        self.path.mkdir(exist_ok=True)
+        salt = secrets.token_bytes(16)
+        token = self.fernet(config, salt).encrypt(json.dumps(state).encode("utf-8"))
+        athlete_file = self.athlete_file(config)
+        temp_file = athlete_file.with_suffix(".tmp")
+        temp_file.write_text(
+            json.dumps({"salt": base64.b64encode(salt).decode("ascii"), "token": token.decode("ascii")}),
+            encoding="utf-8",
+        )
+        os.replace(temp_file, athlete_file)
@@ -1,27 +1,22 @@
+from __future__ import annotations
+
+import bisect
+import hashlib
+import json
+import random
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, date
-from functools import lru_cache
+from functools import wraps
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import requests
 from loguru import logger
 
-from trainaspower import models
-
-stryd_session = requests.Session()
-user_id = None
-
-
-def login(email, password) -> None:
-    r = stryd_session.post(
-        "https://www.stryd.com/b/email/signin",
-        json={"email": email, "password": password},
-    )
-    if r.status_code != 200:
-        raise Exception("Failed to log in to Stryd")
-    login_info = r.json()
-    stryd_session.headers.update({"Authorization": f"Bearer: {login_info['token']}"})
-    global user_id
-    user_id = login_info["id"]
-
+from trainaspower import cache, models, pacetable, transport
 
 prediction_url = "https://www.stryd.com/b/api/v1/users/race/prediction"
 params = {
@@ -37,57 +32,303 @@ params = {
     "target_time": 330,
     "depth": "complete",
 }
+params_hash = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+# Paces (in seconds per mile) sampled from the Stryd calculator to fit the local pace to power model
+model_anchor_paces = [240, 300, 360, 420, 480, 570, 690, 840, 960]
+
+
+class PaceModel:
+    """Monotone pace to power curve, linearly interpolated in speed between sampled anchor paces."""
+
+    def __init__(self, points: List[Tuple[int, float]]):
+        # Slowest pace first, so speeds are ascending
+        points = sorted(points, reverse=True)
+        self.points = points
+        self.speeds = [1 / seconds for seconds, _ in points]
+        # Power can only go up with speed
+        self.powers = list(accumulate((power for _, power in points), max))
+
+    def __call__(self, seconds: int) -> Optional[float]:
+        """Returns the modelled power for a pace, or None if the pace is outside the sampled range."""
+        speed = 1 / seconds
+        if not self.speeds[0] <= speed <= self.speeds[-1]:
+            return None
+        i = bisect.bisect_left(self.speeds, speed)
+        if self.speeds[i] == speed:
+            return self.powers[i]
+        fraction = (speed - self.speeds[i - 1]) / (self.speeds[i] - self.speeds[i - 1])
+        return self.powers[i - 1] + fraction * (self.powers[i] - self.powers[i - 1])
+
+
+class CachedCall:
+    __slots__ = ("lock", "done", "result")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.done = False
+        self.result = None
+
+
+def cached_once(func):
+    """
+    Caches a method's result for each instance and arguments. A call made while the same call on the same instance
+    is already running waits for its result, other calls go ahead.
+
+    Used for requests whose result is shared by every step of a sync, so concurrent conversions make them once.
+    """
+
+    @wraps(func)
+    def wrapper(self, *args):
+        with self.cached_calls_lock:
+            call = self.cached_calls.setdefault((func.__name__, args), CachedCall())
+        with call.lock:
+            if not call.done:
+                call.result = func(self, *args)
+                call.done = True
+            return call.result
+
+    return wrapper
+
+
+def seconds_per_mile(pace: float) -> int:
+    """Rounds a pace in seconds per meter to the whole seconds per mile used by the Stryd calculator."""
+    return round(pace * models.meters_per_unit["mi"])
+
+
+class Stryd:
+    """Stryd session for a single athlete."""
+
+    def __init__(self, concurrency: int = 4):
+        self.session = transport.new_session()
+        self.user_id = None
+        self.token = None
+        self.credentials = None
+        # Limits how many requests are made to Stryd at the same time
+        self.concurrency = concurrency
+        self.request_slots = threading.BoundedSemaphore(concurrency)
+        self.pace_model: Optional[PaceModel] = None
+        self.pace_table: Optional[pacetable.PaceTable] = None
+        # Power for each pace (in seconds per mile) converted so far, filled in one batch by `resolve_paces`
+        self.powers: Dict[int, float] = {}
+        # Results of the `cached_once` methods by method name and arguments
+        self.cached_calls: Dict[tuple, CachedCall] = {}
+        self.cached_calls_lock = threading.Lock()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        with self.request_slots:
+            r = self.session.get(url, **kwargs)
+        if r.status_code == 401 and self.credentials:
+            logger.info("Stryd session expired, logging in again")
+            self.login(*self.credentials)
+            with self.request_slots:
+                r = self.session.get(url, **kwargs)
+        return r
+
+    def login(self, email, password) -> None:
+        self.credentials = (email, password)
+        r = self.session.post(
+            "https://www.stryd.com/b/email/signin",
+            json={"email": email, "password": password},
+        )
+        if r.status_code != 200:
+            raise Exception("Failed to log in to Stryd")
+        login_info = r.json()
+        self.authorize(login_info["token"], login_info["id"])
+
+    def authorize(self, token: str, user_id) -> None:
+        self.token = token
+        self.user_id = user_id
+        self.session.headers.update({"Authorization": f"Bearer: {token}"})
+
+    def session_state(self) -> dict:
+        return {"token": self.token, "user_id": self.user_id}
+
+    def restore_session(self, email, password, state: dict) -> None:
+        """Reuses a session saved by `session_state`, logging in again with the credentials once it expires."""
+        self.credentials = (email, password)
+        self.authorize(state["token"], state["user_id"])
+
+    def reset_caches(self) -> None:
+        """Forgets the in memory conversions and profile, so changes on Stryd are picked up by long running syncs."""
+        with self.cached_calls_lock:
+            self.cached_calls.clear()
+        self.powers.clear()
+
+    @cached_once
+    def pace_cache_namespace(self) -> str:
+        """
+        Cache namespace for pace to power conversions of the logged in athlete.
+
+        Cached conversions are dropped whenever the athlete's critical power has changed since they were stored.
+        """
+        athlete_prefix = f"pace_power:{self.user_id}:"
+        if cache.store is not None:
+            critical_power = self.get_critical_power()
+            if cache.store.get("critical_power", str(self.user_id)) != critical_power:
+                logger.debug("Critical power changed, clearing cached pace to power conversions")
+                cache.store.clear(athlete_prefix)
+                cache.store.set("critical_power", str(self.user_id), critical_power)
+        return f"{athlete_prefix}{params_hash}"
+
+    def get_power_from_pace(self, pace: float) -> float:
+        """Power for a pace in seconds per meter."""
+        seconds = seconds_per_mile(pace)
+        if seconds <= 0:
+            return 0
+        return self.get_power_from_seconds_per_mile(seconds)
+
+    def resolve_paces(self, paces: Iterable[float]) -> None:
+        """
+        Converts many paces (in seconds per meter) to power at once, so later `get_power_from_pace` calls for them
+        are answered from memory.
+
+        Paces are deduplicated by the whole seconds per mile Stryd is asked for, and requested concurrently.
+        """
+        seconds = {s for s in map(seconds_per_mile, paces) if s > 0} - self.powers.keys()
+        if not seconds:
+            return
+        logger.debug(f"Converting {len(seconds)} distinct paces to power")
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            # Consume the results so any error is raised here
+            list(pool.map(self.get_power_from_seconds_per_mile, sorted(seconds)))
+
+    def get_power_from_seconds_per_mile(self, seconds: int) -> float:
+        power = self.powers.get(seconds)
+        if power is None:
+            power = self.powers[seconds] = self.convert_seconds_per_mile(seconds)
+        return power
+
+    def convert_seconds_per_mile(self, seconds: int) -> float:
+        if self.pace_table is not None:
+            power = self.pace_table.get(seconds)
+            if power is not None:
+                return power
+        if self.pace_model is not None:
+            power = self.pace_model(seconds)
+            if power is not None:
+                return power
+        return self.request_power(seconds)
+
+    def request_power(self, seconds: int) -> float:
+        """Power for a pace in seconds per mile from the Stryd calculator, or the cache of its earlier answers."""
+        namespace = self.pace_cache_namespace()
+        if cache.store is not None:
+            power = cache.store.get(namespace, str(seconds))
+            if power is not None:
+                return power
+        logger.debug(f"Converting {seconds} seconds/mile to power via Stryd calculator")
+        r = self.get(prediction_url, params={**params, "target_time": seconds})
+        power = r.json()["power_range"]["target"]
+        if cache.store is not None:
+            cache.store.set(namespace, str(seconds), power)
+        return power
+
+    def load_pace_model(self, error_bound: float, spot_checks: int) -> None:
+        """
+        Fits the local pace to power model from a few Stryd calculator samples, at most once per athlete per day.
+
+        The fitted model is checked against live samples between the anchor paces, and is not used if any of them
+        differs by more than `error_bound` watts.
+        """
+        self.pace_model = None
+        namespace = f"{self.pace_cache_namespace()}:model"
+        today = date.today().isoformat()
+        points = cache.store.get(namespace, today) if cache.store is not None else None
+        if points:
+            self.pace_model = PaceModel([tuple(p) for p in points])
+            return
+
+        logger.info("Fitting pace to power model from Stryd calculator")
+        model = PaceModel([(s, self.get_power_from_seconds_per_mile(s)) for s in model_anchor_paces])
+        intervals = list(zip(model_anchor_paces, model_anchor_paces[1:]))
+        checks = random.sample(intervals, min(spot_checks, len(intervals)))
+        for faster, slower in checks:
+            seconds = (faster + slower) // 2
+            error = abs(model(seconds) - self.get_power_from_seconds_per_mile(seconds))
+            if error > error_bound:
+                logger.warning(
+                    f"Pace to power model is off by {error:.1f}W at {seconds} seconds/mile, "
+                    f"falling back to the Stryd calculator for every pace"
+                )
+                return
+        if cache.store is not None:
+            cache.store.set(namespace, today, model.points)
+        self.pace_model = model
+
+    def load_pace_table(self, directory: Path, fastest: float, slowest: float) -> None:
+        """
+        Opens the athlete's pace to power table for paces between `fastest` and `slowest` (seconds per meter).
+
+        If there is no table from today the Stryd calculator is asked for every pace in between, on a pool of
+        threads, and the table is saved for every later conversion that day.
+        """
+        self.pace_table = None
+        first, last = seconds_per_mile(fastest), seconds_per_mile(slowest)
+        critical_power = self.get_critical_power()
+        path = directory / f"{self.user_id}.bin"
+        try:
+            table = pacetable.PaceTable(path)
+            if table.matches(first, last, critical_power, params_hash):
+                self.pace_table = table
+                return
+        except (OSError, ValueError):
+            pass
+
+        logger.info(f"Building pace to power table for {last - first + 1} paces from Stryd calculator")
+
+        def request_powers(seconds: range) -> list:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                return list(pool.map(self.request_power, seconds))
+
+        try:
+            self.pace_table = pacetable.build(path, first, last, critical_power, params_hash, request_powers)
+        except Exception:
+            logger.opt(exception=True).warning(
+                "Could not build pace to power table, falling back to the Stryd calculator for every pace"
+            )
+
+    def convert_pace_range_to_power(self, pace_range: models.PaceRange) -> models.PowerRange:
+        return models.PowerRange(
+            self.get_power_from_pace(pace_range.min), self.get_power_from_pace(pace_range.max)
+        )
+
+    def suggested_power_range_for_distance(self, distance: float) -> models.PowerRange:
+        """Suggested power range for a distance in meters."""
+        logger.debug(f"Getting suggested power range for {distance} meters")
+        r = self.get(prediction_url, params={**params, "race_distance": distance})
+        suggested_range = r.json()["power_range_suggested"]
+        return models.PowerRange(suggested_range["min"], suggested_range["max"])
+
+    @cached_once
+    def get_power_duration_curve(self, datarange: str) -> array:
+        """Power duration curve for the given date window, indexed by duration in seconds minus one."""
+        namespace = f"power_duration_curve:{self.user_id}"
+        if cache.store is not None:
+            power_list = cache.store.get(namespace, datarange, max_age=timedelta(days=1))
+            if power_list is not None:
+                return array("d", power_list)
+        logger.debug(f"Fetching power duration curve for {datarange}")
+        url = "https://www.stryd.com/b/api/v1/users/powerdurationcurve"
+        response = self.get(url, params={"datarange": datarange, "detraining": 0})
+        power_list = response.json()[0]["power_list"]
+        if cache.store is not None:
+            cache.store.set(namespace, datarange, power_list)
+        return array("d", power_list)
+
+    def suggested_power_range_for_time(self, time: float) -> models.PowerRange:
+        """Suggested power range for a time in seconds."""
+        logger.debug(f"Getting suggested power range for {time} seconds.")
+        today = date.today()
+        curve = self.get_power_duration_curve(f"{today-timedelta(days=90):%m.%d.%Y}-{today:%m.%d.%Y}")
+        power = curve[round(time - 1)]
+        # What should the range be?
+        return models.PowerRange(power - 5, power + 10)
 
+    @cached_once
+    def get_profile(self) -> dict:
+        url = f"https://www.stryd.com/b/api/v1/users/{self.user_id}"
+        return self.get(url).json()
 
-@lru_cache()
-@models.ureg.check("[time] / [length]")
-def get_power_from_pace(pace: models.Quantity) -> float:
-    seconds = round(pace.to("seconds/mile").magnitude)
-    if seconds <= 0:
-        return 0
-    logger.debug(f"Converting {pace} to power via Stryd calculator")
-    r = stryd_session.get(prediction_url, params={**params, "target_time": seconds})
-    return r.json()["power_range"]["target"]
-
-
-def convert_pace_range_to_power(pace_range: models.PaceRange) -> models.PowerRange:
-    return models.PowerRange(
-        get_power_from_pace(pace_range.min), get_power_from_pace(pace_range.max)
-    )
-
-
-@models.ureg.check("[length]")
-def suggested_power_range_for_distance(distance: models.Quantity) -> models.PowerRange:
-    logger.debug(f"Getting suggested power range for {distance}")
-    r = stryd_session.get(
-        prediction_url, params={**params, "race_distance": distance.to(models.ureg.meter).magnitude}
-    )
-    suggested_range = r.json()["power_range_suggested"]
-    return models.PowerRange(suggested_range["min"], suggested_range["max"])
-
-
-@models.ureg.check("[time]")
-def suggested_power_range_for_time(time: models.Quantity) -> models.PowerRange:
-    logger.debug(f"Getting suggested power range for {time}.")
-    today = date.today()
-    url = "https://www.stryd.com/b/api/v1/users/powerdurationcurve"
-    params = {
-        "datarange": f"{today-timedelta(days=90):%m.%d.%Y}-{today:%m.%d.%Y}",
-        "detraining": 0,
-    }
-    response = stryd_session.get(url, params=params)
-    power = response.json()[0]["power_list"][
-        round(time.to('seconds').magnitude - 1)
-    ]
-    # What should the range be?
-    return models.PowerRange(power - 5, power + 10)
-
-
-@lru_cache()
-def get_profile() -> dict:
-    url = f"https://www.stryd.com/b/api/v1/users/{user_id}"
-    return stryd_session.get(url).json()
-
-
-def get_critical_power() -> float:
-    return get_profile()["training_info"]["critical_power"]
+    def get_critical_power(self) -> float:
+        return self.get_profile()["training_info"]["critical_power"]
@@ -0,0 +1,157 @@
+"""
+The parts of a sync shared by the command line and the asyncio engine: logins and saved sessions, the sync journal,
+pace conversion, uploads, the stored plans and the batch summary.
+"""
+import datetime
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+import trainaspower
+from trainaspower import finalsurge, journal, models, plans, sessions, stryd, timings, trainasone
+
+if getattr(sys, "frozen", False):
+    directory = Path(sys.executable).parent
+else:
+    directory = Path(trainaspower.__file__).parent.parent
+
+
+def daterange(start_date: datetime.date, end_date: datetime.date):
+    if isinstance(start_date, datetime.datetime):
+        start_date = start_date.date()
+    if isinstance(end_date, datetime.datetime):
+        end_date = end_date.date()
+    for n in range(int((end_date - start_date).days)):
+        yield start_date + datetime.timedelta(n)
+
+
+def write_debug_file(exc: trainasone.FindWorkoutException, prefix: str = "") -> str:
+    filename = f"{prefix}{exc.filename}"
+    with open(directory / filename, "w", encoding="utf-8") as f:
+        f.write(exc.html)
+    return filename
+
+
+session_store = sessions.SessionStore(directory / "trainaspower_sessions")
+journal_directory = directory / "trainaspower_journal"
+
+
+def open_journal(config: models.Config) -> Optional[journal.Journal]:
+    """The journal of the athlete's last failed sync today, when `resume_syncs` is on."""
+    return journal.Journal.for_athlete(journal_directory, config) if config.resume_syncs else None
+
+
+def login(
+    config: models.Config,
+    tao_client: trainasone.TrainAsOne,
+    finalsurge_client: finalsurge.FinalSurge,
+    stryd_client: stryd.Stryd,
+) -> None:
+    """Logs in to every service, reusing the sessions saved by the last run when `remember_logins` is on."""
+    with timings.phase("login"):
+        saved = session_store.load(config) if config.remember_logins else {}
+        for name, client, email, password in services(config, tao_client, finalsurge_client, stryd_client):
+            login_service(name, client, email, password, saved)
+
+
+def services(
+    config: models.Config,
+    tao_client: trainasone.TrainAsOne,
+    finalsurge_client: finalsurge.FinalSurge,
+    stryd_client: stryd.Stryd,
+) -> list[tuple]:
+    """Name, client and credentials of each service."""
+    return [
+        ("trainasone", tao_client, config.trainasone_email, config.trainasone_password),
+        ("finalsurge", finalsurge_client, config.finalsurge_email, config.finalsurge_password),
+        ("stryd", stryd_client, config.stryd_email, config.stryd_password),
+    ]
+
+
+def login_service(name: str, client, email: str, password: str, saved: dict) -> None:
+    if name in saved:
+        logger.debug(f"Reusing saved {name} session")
+        client.restore_session(email, password, saved[name])
+    else:
+        client.login(email, password)
+
+
+def save_sessions(
+    config: models.Config,
+    tao_client: trainasone.TrainAsOne,
+    finalsurge_client: finalsurge.FinalSurge,
+    stryd_client: stryd.Stryd,
+) -> None:
+    if not config.remember_logins:
+        return
+    session_store.save(config, {
+        "trainasone": tao_client.session_state(),
+        "finalsurge": finalsurge_client.session_state(),
+        "stryd": stryd_client.session_state(),
+    })
+
+
+def load_pace_conversion(config: models.Config, stryd_client: stryd.Stryd) -> None:
+    """Prepares the pace to power model or table, when `pace_conversion` uses one."""
+    if config.pace_only:
+        return
+    with timings.phase("conversion"):
+        if config.pace_conversion == "model":
+            stryd_client.load_pace_model(config.model_error_bound, config.model_spot_checks)
+        elif config.pace_conversion == "table":
+            fastest, slowest = (trainasone.parse_time(pace) / 1000 for pace in config.pace_table_range)
+            stryd_client.load_pace_table(directory / "trainaspower_pace_tables", fastest, slowest)
+
+
+def store_plan(config: models.Config, workouts: list[models.Workout], removed: list[datetime.date]) -> None:
+    """Keeps the synced workouts for `reapply`."""
+    if plans.store is not None and (workouts or removed):
+        plans.store.update(config, workouts, removed)
+
+
+def upload_workout(
+    finalsurge_client: finalsurge.FinalSurge, wo: models.Workout, sync_journal: Optional[journal.Journal]
+) -> str:
+    """Adds the workout to Final Surge, unless the journal shows the failed sync already did."""
+    if sync_journal is None:
+        return finalsurge_client.add_workout(wo)
+    payload_hash = finalsurge.payload_hash(wo)
+    if sync_journal.uploaded(wo, payload_hash):
+        logger.info(f"Workout `{wo.name}` was already uploaded to Final Surge")
+        return "skipped"
+    result = finalsurge_client.add_workout(wo)
+    sync_journal.record_uploaded(wo, payload_hash)
+    return result
+
+
+def format_results(results: Counter) -> str:
+    return (
+        f"{results['created']} created, {results['updated']} updated, "
+        f"{results['skipped']} unchanged, {results['deleted']} deleted"
+    )
+
+
+def batch_failure(config: models.Config, exc: trainasone.FindWorkoutException) -> Exception:
+    filename = write_debug_file(exc, prefix=f"{config.trainasone_email}-")
+    return Exception(f"Could not load next Train as One workout. Created {filename} for debugging.")
+
+
+def log_batch_summary(configs: list[models.Config], outcomes: list) -> bool:
+    """Logs the results or exception of each athlete's sync. Returns whether all succeeded."""
+    summary = []
+    failures = 0
+    for config, outcome in zip(configs, outcomes):
+        if isinstance(outcome, Exception):
+            failures += 1
+            logger.opt(exception=outcome).debug(f"Sync failed for {config.trainasone_email}")
+            summary.append(f"  {config.trainasone_email}: FAILED ({outcome})")
+        else:
+            summary.append(f"  {config.trainasone_email}: {format_results(outcome)}")
+    logger.info(
+        f"Batch sync complete, {len(configs) - failures} of {len(configs)} athletes succeeded:\n"
+        + "\n".join(summary)
+    )
+    return not failures
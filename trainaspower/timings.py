@@ -0,0 +1,53 @@
+"""Records how far into a run each startup phase was reached, and how long each phase of the sync took."""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from loguru import logger
+
+started = time.perf_counter()
+marks = {}
+# Total seconds and number of times each sync phase ran. Phases run by several threads at once can add up to
+# more than the wall time.
+phases = defaultdict(lambda: [0.0, 0])
+phases_lock = threading.Lock()
+
+# Startup budget in seconds from import until the first network request is made
+first_request_target = 0.5
+
+
+def mark(name: str) -> None:
+    marks[name] = time.perf_counter() - started
+
+
+def mark_once(name: str) -> None:
+    """Marks the first time `name` is reached, later calls keep that time."""
+    marks.setdefault(name, time.perf_counter() - started)
+
+
+@contextmanager
+def phase(name: str):
+    phase_started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - phase_started
+        with phases_lock:
+            phases[name][0] += elapsed
+            phases[name][1] += 1
+
+
+def report() -> None:
+    lines = []
+    for name, elapsed in marks.items():
+        line = f"  {name:<16}{elapsed:8.3f}s"
+        if name == "first request":
+            status = "met" if elapsed <= first_request_target else "missed"
+            line += f"  (target {first_request_target:.3f}s {status})"
+        lines.append(line)
+    logger.info("Timings since trainaspower was imported:\n" + "\n".join(lines))
+    with phases_lock:
+        lines = [f"  {name:<16}{total:8.3f}s  ({count}x)" for name, (total, count) in phases.items()]
+    if lines:
+        logger.info("Time spent in each phase:\n" + "\n".join(lines))
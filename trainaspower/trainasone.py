@@ -1,22 +1,166 @@
+from __future__ import annotations
+
+import copy
 import datetime
+import functools
+import hashlib
+import json
 import re
 from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
 from itertools import compress
+from urllib.parse import urljoin, urlparse
 
-import dateparser
-import requests_html
-from fitparse import FitFile
+import requests
 from loguru import logger
+from lxml import etree, html
+
+from . import cache, fit, models, timings, transport
+from .journal import Journal
+from .stryd import Stryd
+from .stryd import params_hash as stryd_params_hash
 
-from . import models
-from .stryd import (
-    convert_pace_range_to_power,
-    get_critical_power,
-    suggested_power_range_for_distance,
-    suggested_power_range_for_time,
+user_agent = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/603.3.8 (KHTML, like Gecko) "
+    "Version/10.1.2 Safari/603.3.8"
 )
 
-tao_session = requests_html.HTMLSession()
+
+def has_class(name: str) -> str:
+    """XPath predicate equivalent to the CSS `.name` selector."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+calendar_days_xpath = etree.XPath(f"//*[{has_class('today')} or {has_class('future')}]")
+day_title_xpath = etree.XPath(f".//*[{has_class('title')}]")
+day_workout_link_xpath = etree.XPath(f".//*[{has_class('workout')}]//a/@href")
+workout_detail_xpath = etree.XPath(f"//*[{has_class('detail')}]")
+workout_detail_span_xpath = etree.XPath(f"//*[{has_class('detail')}]/span")
+
+# Whitespace as HTML defines it, a non-breaking space is not whitespace
+whitespace_re = re.compile("[\x20\x09\x0c\u200b\x0a\x0d]+")
+inline_tags = {
+    "a", "abbr", "acronym", "b", "bdo", "big", "br", "button", "cite", "code", "dfn", "em", "i", "img", "input", "kbd",
+    "label", "map", "object", "q", "samp", "script", "select", "small", "span", "strong", "sub", "sup", "textarea",
+    "time", "tt", "var",
+}
+# Marks the edges of block level elements in the parts of `element_text`, and line breaks
+block_edge, line_break = None, True
+
+
+def element_text(element) -> str:
+    """
+    Text of an element as requests_html (pyquery) gives it, with whitespace collapsed and every element which is
+    not inline on its own lines.
+    """
+    parts = []
+
+    def walk(el):
+        if not isinstance(el.tag, str):
+            # Comments and processing instructions
+            return
+        block = el.tag not in inline_tags
+        parts.append(line_break if el.tag == "br" else block_edge if block else "")
+        parts.append(el.text or "")
+        for child in el:
+            walk(child)
+            parts.append(child.tail or "")
+        if block:
+            parts.append(block_edge)
+
+    walk(element)
+    # Join the text between block edges and line breaks, and only keep one block edge where several meet
+    lines = []
+    text = []
+    for part in parts + [block_edge]:
+        if isinstance(part, str):
+            text.append(part)
+            continue
+        run = whitespace_re.sub(" ", "".join(text)).strip()
+        text = []
+        if run:
+            lines.append(run)
+        if part is line_break or (lines and lines[-1] is not block_edge):
+            lines.append(part)
+    while lines and not isinstance(lines[-1], str):
+        lines.pop()
+    while lines and not isinstance(lines[0], str):
+        lines.pop(0)
+    return "".join("\n" if line is block_edge or line is line_break else line for line in lines)
+
+
+def parse_calendar(page: str, base_url: str) -> list[tuple[str, str]]:
+    """Returns the title and absolute workout url of each upcoming calendar day which has a workout."""
+    tree = html.fromstring(page)
+    days = []
+    for day in calendar_days_xpath(tree):
+        links = day_workout_link_xpath(day)
+        if links:
+            days.append((element_text(day_title_xpath(day)[0]), urljoin(base_url, links[0])))
+    return days
+
+
+month_names = (
+    "january", "february", "march", "april", "may", "june",
+    "july", "august", "september", "october", "november", "december",
+)
+month_numbers = {
+    **{name: number for number, name in enumerate(month_names, 1)},
+    **{name[:3]: number for number, name in enumerate(month_names, 1)},
+    "sept": 9,
+}
+weekday_pattern = r"(?:[a-z]+,?\s+)?"
+day_month_re = re.compile(
+    rf"{weekday_pattern}(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\s+(?P<month>[a-z]+)\.?(?:,?\s+(?P<year>\d{{4}}))?",
+    re.IGNORECASE,
+)
+month_day_re = re.compile(
+    rf"{weekday_pattern}(?P<month>[a-z]+)\.?\s+(?P<day>\d{{1,2}})(?:st|nd|rd|th)?(?:,?\s+(?P<year>\d{{4}}))?",
+    re.IGNORECASE,
+)
+relative_days = {"today": 0, "tomorrow": 1}
+
+
+def parse_calendar_date(text: str, today: datetime.date | None = None) -> datetime.datetime:
+    """
+    Returns midnight of the day a calendar day title such as `Wed 17 Oct` refers to.
+
+    Titles without a year get the year which puts them closest to today. Formats other than those TrainAsOne uses
+    are left to dateparser.
+    """
+    today = today or datetime.date.today()
+    text = text.strip()
+    if text.lower() in relative_days:
+        day = today + datetime.timedelta(relative_days[text.lower()])
+        return datetime.datetime(day.year, day.month, day.day)
+    for date_re in (day_month_re, month_day_re):
+        match = date_re.fullmatch(text)
+        if not match or match["month"].lower() not in month_numbers:
+            continue
+        month, day = month_numbers[match["month"].lower()], int(match["day"])
+        try:
+            if match["year"]:
+                return datetime.datetime(int(match["year"]), month, day)
+            return min(
+                (datetime.datetime(year, month, day) for year in (today.year - 1, today.year, today.year + 1)),
+                key=lambda d: abs(d.date() - today),
+            )
+        except ValueError:
+            # Such as 29 Feb in the wrong year, leave it to dateparser
+            break
+    return dateparser_parse(text, today)
+
+
+@functools.lru_cache(maxsize=256)
+def dateparser_parse(text: str, today: datetime.date) -> datetime.datetime:
+    # Loading dateparser takes seconds, so it is only imported for titles `parse_calendar_date` does not know.
+    # `today` is part of the cache key, as relative dates change meaning every day.
+    import dateparser
+
+    parsed = dateparser.parse(text)
+    if parsed is None:
+        raise ValueError(f"Could not read the date `{text}`")
+    return parsed
 
 
 class FindWorkoutException(Exception):
@@ -27,36 +171,214 @@ class FindWorkoutException(Exception):
         self.filename = filename
 
 
-def login(email, password) -> None:
-    r = tao_session.post(
-        "https://beta.trainasone.com/login",
-        data={"email": email, "password": password},
-        allow_redirects=False,
-    )
-    if not r.is_redirect:
-        raise Exception("Failed to login to Train as One")
-
-
-def get_next_workouts(config) -> Generator[models.Workout, None, None]:
-    logger.info("Fetching next TrainAsOne workout.")
-    r = tao_session.get("https://beta.trainasone.com/calendarView")
-    found = False
-    try:
-        upcoming = r.html.find(".today, .future")
-        for day in upcoming:
-            if day.find(".workout"):
-                date = dateparser.parse(
-                    day.find(".title", first=True).text.splitlines()[-1]
-                )
-                workout_url = day.find(".workout a", first=True).absolute_links.pop()
-                yield get_workout(workout_url, date, config)
-                found = True
-        if not found:
-            raise Exception("Next tao workout not found.")
-    except Exception as exc:
-        raise FindWorkoutException(
-            f"Error finding next TaO workout: {exc.args[0]}", "taocalendar.html", r.text
-        ) from exc
+class TrainAsOne:
+    """TrainAsOne session for a single athlete."""
+
+    def __init__(self):
+        self.session = transport.new_session()
+        self.session.headers["User-Agent"] = user_agent
+        self.credentials = None
+        # The last calendar page loaded, kept for debugging failures of the workouts found on it
+        self.calendar_html = ""
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        r = self.session.request(method, url, **kwargs)
+        # An expired session gets redirected to the login page
+        if self.credentials and (r.status_code == 401 or urlparse(r.url).path == "/login"):
+            logger.info("TrainAsOne session expired, logging in again")
+            self.login(*self.credentials)
+            r = self.session.request(method, url, **kwargs)
+        return r
+
+    def login(self, email, password) -> None:
+        self.credentials = (email, password)
+        r = self.session.post(
+            "https://beta.trainasone.com/login",
+            data={"email": email, "password": password},
+            allow_redirects=False,
+        )
+        if not r.is_redirect:
+            raise Exception("Failed to login to Train as One")
+
+    def session_state(self) -> dict:
+        return {
+            "cookies": [
+                {
+                    "name": cookie.name,
+                    "value": cookie.value,
+                    "domain": cookie.domain,
+                    "path": cookie.path,
+                    "expires": cookie.expires,
+                }
+                for cookie in self.session.cookies
+            ]
+        }
+
+    def restore_session(self, email, password, state: dict) -> None:
+        """Reuses a session saved by `session_state`, logging in again with the credentials once it expires."""
+        self.credentials = (email, password)
+        for cookie in state["cookies"]:
+            self.session.cookies.set(**cookie)
+        self.session.cookies.clear_expired_cookies()
+
+    def get_calendar(self) -> list[tuple[datetime.datetime, str]]:
+        """Returns the date and workout url of each upcoming day on the calendar which has a workout."""
+        with timings.phase("calendar"):
+            r = self.request("GET", "https://beta.trainasone.com/calendarView")
+            self.calendar_html = r.text
+            try:
+                return [
+                    (parse_calendar_date(title.splitlines()[-1]), workout_url)
+                    for title, workout_url in parse_calendar(r.text, r.url)
+                ]
+            except Exception as exc:
+                raise FindWorkoutException(
+                    f"Error reading TaO calendar: {exc.args[0]}", "taocalendar.html", r.text
+                ) from exc
+
+    def get_next_workouts(
+        self, config: models.Config, stryd: Stryd, journal: Journal | None = None
+    ) -> Generator[models.Workout, None, None]:
+        """Yields the next `config.number_of_workouts` workouts in date order."""
+        logger.info("Fetching next TrainAsOne workout.")
+        calendar = self.get_calendar()[: config.number_of_workouts]
+        if not calendar:
+            raise FindWorkoutException(
+                "Error finding next TaO workout: Next tao workout not found.",
+                "taocalendar.html",
+                self.calendar_html,
+            )
+        yield from self.get_workouts(calendar, config, stryd, journal)
+
+    def get_workouts(
+        self,
+        calendar: list[tuple[datetime.datetime, str]],
+        config: models.Config,
+        stryd: Stryd,
+        journal: Journal | None = None,
+    ) -> Generator[models.Workout, None, None]:
+        """
+        Yields the workouts for the given calendar days in order.
+
+        Every workout is downloaded first, on a pool of `config.trainasone_concurrency` threads, so the distinct
+        paces of all their steps can be converted to power in one concurrent batch before the steps are built.
+        Workouts the `journal` has already downloaded or converted are not downloaded or converted again, and
+        workouts converted by an earlier sync from the same FIT file and settings are not converted again.
+        """
+        pool = ThreadPoolExecutor(max_workers=config.trainasone_concurrency)
+        try:
+            downloads = [
+                pool.submit(self.fetch_workout, workout_url, date, config, journal)
+                for date, workout_url in calendar
+            ]
+            downloaded = [
+                (workout_id, w, None if steps is not None and reuse_conversion(w, config, stryd) else steps)
+                for workout_id, w, steps in (future.result() for future in downloads)
+            ]
+            if not config.pace_only:
+                with timings.phase("conversion"):
+                    stryd.resolve_paces(
+                        pace for _, _, steps in downloaded if steps is not None for pace in step_paces(steps)
+                    )
+            for workout_id, w, steps in downloaded:
+                if steps is not None:
+                    w = convert_workout_steps(w, steps, config, stryd)
+                    if journal:
+                        journal.record_converted(workout_id, w)
+                yield w
+        except FindWorkoutException:
+            raise
+        except Exception as exc:
+            raise FindWorkoutException(
+                f"Error finding next TaO workout: {exc.args[0]}", "taocalendar.html", self.calendar_html
+            ) from exc
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def fetch_workout(
+        self, workout_url: str, date: datetime.date, config: models.Config, journal: Journal | None
+    ) -> tuple[str, models.Workout, list[dict] | None]:
+        """
+        Returns the workout id and `download_workout` of a workout, resuming from the journal if it has the
+        workout. The steps are None when the journal has the converted workout.
+        """
+        workout_id = workout_id_from_url(workout_url)
+        fetched = journal.fetched(date, workout_id) if journal else None
+        if fetched is not None:
+            logger.debug(f"Resuming workout {workout_id} from the sync journal")
+            return (workout_id, *fetched)
+        w, steps = self.download_workout(workout_url, date, config)
+        if journal:
+            journal.record_fetched(workout_id, w, steps)
+        return workout_id, w, steps
+
+    def download_workout(
+        self,
+        workout_url: str,
+        date: datetime.date,
+        config: models.Config,
+    ) -> tuple[models.Workout, list[dict]]:
+        """Returns the workout, without its steps, and its FIT workout steps ready for `convert_steps`."""
+        workout_id = workout_id_from_url(workout_url)
+        workout_download_url = "https://beta.trainasone.com/plannedWorkoutDownload"
+        r = self.request(
+            "POST",
+            workout_download_url,
+            data={
+                "workoutId": workout_id,
+                "temperature": "",
+                "undulation": "",
+                "sourceFormat": "FIT",
+                "includeRunBackStep": config.include_runback_step,
+                "_includeRunBackStep": "on",
+                "workoutStepEnd": "DURATION",
+                "workoutStepName": "STEP_NAME",
+                "workoutSlowStepTarget": "SPEED",
+                "workoutEasyStepTarget": "SPEED",
+                "workoutFastStepTarget": "SPEED",
+            },
+        )
+
+        with timings.phase("fit parse"):
+            fit_workout = fit.read_workout(r.content)
+            workout_name = fit_workout.name
+            workout_steps = sorted(fit_workout.steps, key=lambda x: x["message_index"])
+
+        w = models.Workout()
+        w.date = date
+        w.source_hash = hashlib.sha256(r.content).hexdigest()[:16]
+        planned = None
+        if config.workout_details_from_fit:
+            planned = planned_duration_and_distance(workout_steps)
+        if planned is None:
+            r_base = self.request("GET", workout_url)
+
+        try:
+            if planned is not None:
+                w.duration, w.distance = planned
+                w.distance_unit = config.distance_unit
+            else:
+                # Fetch the duration and distance from TAO
+                workout_html = html.fromstring(r_base.text)
+                duration = parse_duration(element_text(workout_detail_span_xpath(workout_html)[0]))
+                distance = parse_distance(element_text(workout_detail_xpath(workout_html)[0]))
+                w.duration = duration.to("seconds").magnitude
+                w.distance = distance.to("meters").magnitude
+                w.distance_unit = f"{distance.units:~}"
+
+            title = workout_name
+            number, name = title.split(" ", maxsplit=1)
+            w.id = number
+            w.name = title
+            return w, workout_steps
+        except Exception as exc:
+            raise FindWorkoutException(
+                f"Error finding workout steps: {exc.args}", "taoworkout.html", r.text
+            ) from exc
+
+
+def workout_id_from_url(workout_url: str) -> str:
+    return re.search(r"workoutId=([^&]+)", workout_url).group(1)
 
 
 def decode_cloudflare_email(encoded_email):
@@ -73,79 +395,50 @@ def decode_cloudflare_email(encoded_email):
     return decoded
 
 
-def fit_to_dict(records: dict) -> dict:
-    return {r["name"]: r["value"] for r in records["fields"]}
-
-
-def fit_get_workout_name(fit_file: FitFile) -> str:
-    return next(
-        filter(
-            lambda x: x["name"] == "wkt_name",
-            next(fit_file.get_messages("workout", as_dict=True))["fields"],
-        ),
-    )["value"]
-
-
-def fit_get_workout_steps(fit_file: FitFile) -> list[dict]:
-    steps = [
-        fit_to_dict(step)
-        for step in fit_file.get_messages("workout_step", as_dict=True)
-    ]
-    steps.sort(key=lambda x: x["message_index"])
-    return steps
-
-
-def get_workout(
-    workout_url: str,
-    date: datetime.date,
-    config: models.Config,
-) -> models.Workout:
-    workout_id = re.search(r"workoutId=([^&]+)", workout_url).group(1)
-    workout_download_url = "https://beta.trainasone.com/plannedWorkoutDownload"
-    r = tao_session.post(
-        workout_download_url,
-        data={
-            "workoutId": workout_id,
-            "temperature": "",
-            "undulation": "",
-            "sourceFormat": "FIT",
-            "includeRunBackStep": config.include_runback_step,
-            "_includeRunBackStep": "on",
-            "workoutStepEnd": "DURATION",
-            "workoutStepName": "STEP_NAME",
-            "workoutSlowStepTarget": "SPEED",
-            "workoutEasyStepTarget": "SPEED",
-            "workoutFastStepTarget": "SPEED",
-        },
-    )
-
-    fit_file = FitFile(r.content)
-    workout_name = fit_get_workout_name(fit_file)
-    workout_steps = fit_get_workout_steps(fit_file)
-
-    r_base = tao_session.get(workout_url)
-    w = models.Workout()
-    w.date = date
+def planned_duration_and_distance(steps: list[dict]) -> tuple[float, float] | None:
+    """
+    Works out the planned duration (seconds) and distance (meters) of a workout from its FIT steps.
 
-    try:
-        # Fetch the duration and distance from TAO
-        workout_html = r_base.html
-        w.duration = parse_duration(workout_html.find(".detail>span", first=True).text)
-        w.distance = parse_distance(workout_html.find(".detail", first=True).text)
+    Distance of time based steps and duration of distance based steps are estimated from the middle of the
+    step's pace range, and an open runback step counts as nothing. Returns None when a step has no pace to estimate
+    from or a length other than time or distance.
+    """
+    # Seconds and meters covered by each step, by message index
+    totals = []
+    for step in steps:
+        if step["duration_type"] == "repeat_until_steps_cmplt":
+            # The repeated steps have been counted once already
+            repeated = totals[step["duration_step"] : step["message_index"]]
+            extra = step["repeat_steps"] - 1
+            totals.append((
+                extra * sum(seconds for seconds, _ in repeated),
+                extra * sum(meters for _, meters in repeated),
+            ))
+            continue
+        if step["duration_type"] == "open":
+            # The runback step, which has no planned length
+            totals.append((0, 0))
+            continue
+
+        speeds = []
+        if step["target_type"] == "speed":
+            speeds = [
+                speed
+                for speed in (step["custom_target_speed_low"], step["custom_target_speed_high"])
+                if speed
+            ]
+        if not speeds:
+            return None
+        speed = sum(speeds) / len(speeds)
 
-        steps = workout_steps
-        title = workout_name
-        number, name = title.split(" ", maxsplit=1)
-        w.id = number
-        w.name = title
+        if step["duration_type"] == "time":
+            totals.append((step["duration_time"], step["duration_time"] * speed))
+        elif step["duration_type"] == "distance":
+            totals.append((step["duration_distance"] / speed, step["duration_distance"]))
+        else:
+            return None
 
-        logger.info("Converting TrainAsOne workout to power.")
-        w.steps = convert_steps(steps, config, "Perceived Effort" in name)
-        return w
-    except Exception as exc:
-        raise FindWorkoutException(
-            f"Error finding workout steps: {exc.args}", "taoworkout.html", r.text
-        ) from exc
+    return sum(seconds for seconds, _ in totals), sum(meters for _, meters in totals)
 
 
 def convert_step_type(step: dict) -> str:
@@ -161,15 +454,16 @@ def convert_step_type(step: dict) -> str:
     return "REST"
 
 
-def convert_step_length(step: dict) -> str | None:
+def convert_step_length(step: dict) -> tuple[str | None, float | None]:
+    """Returns the length type of the step, and its length in meters or seconds."""
     if step["duration_type"] == "distance":
-        return round(step["duration_distance"]) * models.meter
+        return "distance", round(step["duration_distance"])
 
     if step["duration_type"] == "open":
         # Runback step
-        return None
+        return None, None
 
-    return step["duration_time"] * models.second
+    return "time", step["duration_time"]
 
 
 def convert_step_target(
@@ -177,19 +471,20 @@ def convert_step_target(
     out_step: models.ConcreteStep,
     perceived_effort: bool,
     num_steps: int,
+    stryd: Stryd,
 ) -> tuple[models.PaceRange | None, models.PowerRange | None]:
     if step["target_type"] == "speed":
         pace_range = parse_pace_range(
             step["custom_target_speed_low"],
             step["custom_target_speed_high"],
         )
-        power_range = convert_pace_range_to_power(pace_range)
+        power_range = stryd.convert_pace_range_to_power(pace_range)
         return pace_range, power_range
 
     # 6 minute assessments, RECOVERY, COOLDOWN, and perceived effort segments do not have a pace
     # Provide a generous power range based on %CP for slower ranges
     if step["target_type"] == "open":
-        cp = get_critical_power()
+        cp = stryd.get_critical_power()
         if perceived_effort:
             # Some perceived effort workouts have a warmup
             if num_steps > 3 and step["message_index"] == 1:
@@ -210,10 +505,10 @@ def convert_step_target(
             return None, models.PowerRange(0, cp * 0.9)
 
         if step["duration_type"] == "distance":
-            return None, suggested_power_range_for_distance(out_step.length)
+            return None, stryd.suggested_power_range_for_distance(out_step.length)
 
         if step["duration_type"] == "time":
-            return None, suggested_power_range_for_time(out_step.length)
+            return None, stryd.suggested_power_range_for_time(out_step.length)
 
         # Run back step has no target. Add a wide power range.
         return None, models.PowerRange(
@@ -225,6 +520,13 @@ def convert_step_target(
     raise ValueError(msg)
 
 
+def step_paces(steps: list[dict]) -> Generator[float, None, None]:
+    """Yields the pace of both ends of every pace target, in seconds per meter."""
+    for step in steps:
+        if step["target_type"] == "speed":
+            yield from parse_pace_range(step["custom_target_speed_low"], step["custom_target_speed_high"])
+
+
 def convert_step_target_pace(step: dict) -> models.PaceRange | None:
     if step["target_type"] == "speed":
         return parse_pace_range(
@@ -235,10 +537,69 @@ def convert_step_target_pace(step: dict) -> models.PaceRange | None:
     return None
 
 
+def convert_workout_steps(
+    w: models.Workout, steps: list[dict], config: models.Config, stryd: Stryd
+) -> models.Workout:
+    """Converts the FIT steps from `TrainAsOne.download_workout` into the workout's steps."""
+    logger.info("Converting TrainAsOne workout to power.")
+    with timings.phase("conversion"):
+        w.unadjusted_steps = convert_steps(steps, config, "Perceived Effort" in w.name, stryd)
+        key = conversion_cache_key(w, config, stryd)
+        if key is not None:
+            cache.store.set(f"converted_steps:{stryd.user_id}", key, [step.to_dict() for step in w.unadjusted_steps])
+        w.steps = apply_power_adjust(w.unadjusted_steps, config.power_adjust)
+    return w
+
+
+def apply_power_adjust(steps: list[models.Step], power_adjust: tuple[float, float]) -> list[models.Step]:
+    """Copies of the steps with `power_adjust` added to their power ranges."""
+    adjusted = []
+    for step in steps:
+        step = copy.copy(step)
+        if isinstance(step, models.RepeatStep):
+            step.steps = apply_power_adjust(step.steps, power_adjust)
+        elif step.power_range:
+            step.power_range += power_adjust
+        adjusted.append(step)
+    return adjusted
+
+
+def conversion_cache_key(w: models.Workout, config: models.Config, stryd: Stryd) -> str | None:
+    """
+    Key of the steps converted from the workout's FIT file with the current settings and critical power, or None
+    if converted steps are not cached.
+    """
+    source_hash = getattr(w, "source_hash", None)
+    if cache.store is None or source_hash is None:
+        return None
+    settings = {
+        "pace_only": config.pace_only,
+        "include_runback_step": config.include_runback_step,
+        "pace_conversion": config.pace_conversion,
+        "critical_power": None if config.pace_only else stryd.get_critical_power(),
+        "stryd_params": stryd_params_hash,
+    }
+    settings_hash = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"{source_hash}:{settings_hash}"
+
+
+def reuse_conversion(w: models.Workout, config: models.Config, stryd: Stryd) -> bool:
+    """Sets the workout's steps from an earlier conversion of the same FIT file, if there is one."""
+    key = conversion_cache_key(w, config, stryd)
+    saved = cache.store.get(f"converted_steps:{stryd.user_id}", key) if key is not None else None
+    if saved is None:
+        return False
+    logger.info(f"Workout `{w.name}` is unchanged on TrainAsOne, reusing its converted steps.")
+    w.unadjusted_steps = [models.Step.from_dict(step) for step in saved]
+    w.steps = apply_power_adjust(w.unadjusted_steps, config.power_adjust)
+    return True
+
+
 def convert_steps(
     steps: list[dict],
     config: models.Config,
     perceived_effort: bool,
+    stryd: Stryd,
 ) -> list[models.Step]:
     steps_out = []
     valid_step = []
@@ -257,7 +618,7 @@ def convert_steps(
             out_step = models.ConcreteStep()
             out_step.description = step["notes"]
             out_step.type = convert_step_type(step)
-            out_step.length = convert_step_length(step)
+            out_step.length_type, out_step.length = convert_step_length(step)
             if config.pace_only:
                 out_step.power_range = None
                 out_step.pace_range = convert_step_target_pace(step)
@@ -267,9 +628,8 @@ def convert_steps(
                     out_step,
                     perceived_effort,
                     len(steps),
+                    stryd,
                 )
-                # Add adjustment from config
-                out_step.power_range += config.power_adjust
 
         valid_step.append(True)
         steps_out.append(out_step)
@@ -278,19 +638,17 @@ def convert_steps(
     return list(compress(steps_out, valid_step))
 
 
-def parse_time(pace_string: str) -> models.Quantity:
+def parse_time(pace_string: str) -> float:
     minutes, sec = map(int, pace_string.split(":"))
-    return minutes * models.minute + sec * models.second
+    return minutes * 60.0 + sec
 
 
 def parse_pace_range(min_provided: float, max_provided: float) -> models.PaceRange:
-    minutes = 0.0
+    """Converts a FIT speed range in meters per second to a pace range in seconds per meter."""
+    seconds = 0.0
     if min_provided != 0.0:
-        minutes = 1 / min_provided
-    return models.PaceRange(
-        minutes * models.second / models.meter,
-        (1 / max_provided) * models.second / models.meter,
-    )
+        seconds = 1 / min_provided
+    return models.PaceRange(seconds, 1 / max_provided)
 
 
 def parse_distance(text: str) -> models.Quantity:
@@ -0,0 +1,302 @@
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from trainaspower import metrics, timings
+
+# Request body fields which are left out of the cassettes
+secret_fields = {"password"}
+
+# Requests per second and burst size allowed to each host, shared by every session of the process
+host_rates: Dict[str, Tuple[float, int]] = {
+    "beta.trainasone.com": (4, 8),
+    "www.stryd.com": (10, 20),
+    "beta.finalsurge.com": (5, 10),
+}
+default_rate = (10, 20)
+# Connections kept open to each host, enough for every athlete's concurrent requests
+pool_size = 32
+# Seconds to connect and to wait for a response, when the caller gives no timeout
+default_timeout = (10, 60)
+
+idempotent_methods = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+retry_statuses = {500, 502, 503, 504}
+max_retries = 3
+# Seconds before the first retry, doubled for every later one
+backoff_base = 0.5
+# Longest `Retry-After` we wait for, a server asking for longer gets its response returned without holding back
+# any other request
+retry_after_max = 60
+
+
+class CassetteMissError(requests.ConnectionError):
+    """Raised when replaying a request which is not in the cassette."""
+
+
+def body_hash(body) -> Optional[str]:
+    """Hash of a JSON or form encoded request body, ignoring the order of its fields and any secrets."""
+    if not body:
+        return None
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    try:
+        fields = json.loads(body)
+    except ValueError:
+        fields = dict(parse_qsl(body, keep_blank_values=True))
+    if isinstance(fields, dict):
+        fields = {k: v for k, v in fields.items() if k not in secret_fields}
+    serialized = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:16]
+
+
+def url_path(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+
+class TokenBucket:
+    """Lets requests through at `rate` per second on average, with bursts of up to `burst` requests."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> None:
+        """Waits for a token. Tokens are taken in turn, a waiting request goes before any later one."""
+        with self.lock:
+            self.refill()
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Holds back every request for `seconds`, as when the host asks us to slow down."""
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+buckets: Dict[str, TokenBucket] = {}
+buckets_lock = threading.Lock()
+
+
+def host_bucket(host: str) -> TokenBucket:
+    with buckets_lock:
+        if host not in buckets:
+            buckets[host] = TokenBucket(*host_rates.get(host, default_rate))
+        return buckets[host]
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a `Retry-After` header, which is either seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff(attempt: int) -> float:
+    # Jittered, so requests which failed together do not all retry together
+    return backoff_base * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+class ServiceAdapter(HTTPAdapter):
+    """
+    Sends requests within the rate limit of their host, and retries those which failed on the way.
+
+    Idempotent requests are retried after connection errors, timeouts and server errors, any request is retried
+    when the host answers 429. A `Retry-After` header decides the wait when there is one, and a 429 holds back
+    every request to that host, otherwise the waits back off exponentially. A response asking for a wait longer
+    than `retry_after_max` is returned at once.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("pool_maxsize", pool_size)
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = default_timeout
+        bucket = host_bucket(urlsplit(request.url).netloc)
+        idempotent = request.method in idempotent_methods
+        for attempt in range(max_retries + 1):
+            bucket.acquire()
+            timings.mark_once("first request")
+            retries_left = attempt < max_retries
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if not (idempotent and retries_left):
+                    raise
+                wait = backoff(attempt)
+                logger.debug(f"{request.method} {request.url} failed ({exc}), retrying in {wait:.1f}s")
+            else:
+                retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+                if retry_after is not None and retry_after > retry_after_max:
+                    # Not worth waiting for, and not worth holding back every other request to the host
+                    return response
+                if response.status_code == 429 and retry_after is not None:
+                    bucket.pause(retry_after)
+                retryable = response.status_code == 429 or (idempotent and response.status_code in retry_statuses)
+                if not (retryable and retries_left):
+                    return response
+                wait = backoff(attempt) if retry_after is None else retry_after
+                logger.debug(
+                    f"{request.method} {request.url} answered {response.status_code}, retrying in {wait:.1f}s"
+                )
+                response.close()
+            time.sleep(wait)
+
+
+class RecordingAdapter(ServiceAdapter):
+    """Sends requests as usual, and writes every request and response to a cassette file when closed."""
+
+    def __init__(self, path: Path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.interactions: List[dict] = []
+        self.lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        content = response.content
+        try:
+            body, encoding = content.decode("utf-8"), "text"
+        except UnicodeDecodeError:
+            body, encoding = base64.b64encode(content).decode("ascii"), "base64"
+        with self.lock:
+            self.interactions.append({
+                "method": request.method,
+                "url": request.url,
+                "body_hash": body_hash(request.body),
+                "status": response.status_code,
+                "reason": response.reason,
+                # Cookies are session secrets and are not needed to replay
+                "headers": {k: v for k, v in response.headers.items() if k.lower() != "set-cookie"},
+                "body": body,
+                "encoding": encoding,
+                "elapsed": response.elapsed.total_seconds(),
+            })
+        return response
+
+    def close(self):
+        super().close()
+        with self.lock:
+            self.path.write_text(json.dumps(self.interactions, indent=1), encoding="utf-8")
+        logger.info(f"Recorded {len(self.interactions)} requests to {self.path}")
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    Answers requests from a cassette file written by `RecordingAdapter`, without any network access.
+
+    A request is matched with the first unused recording of the same method, url and body. When there is none,
+    the query string is ignored, so a cassette can be replayed on a later day than it was recorded. Once every
+    matching recording has been used, the last one is repeated.
+    """
+
+    def __init__(self, path: Path, delay: float = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.interactions = json.loads(path.read_text(encoding="utf-8"))
+        self.used = [False] * len(self.interactions)
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def find(self, request) -> dict:
+        exact = (request.method, request.url, body_hash(request.body))
+        path = (request.method, url_path(request.url))
+        with self.lock:
+            for matches in (
+                lambda i: (i["method"], i["url"], i["body_hash"]) == exact,
+                lambda i: (i["method"], url_path(i["url"])) == path,
+            ):
+                candidates = [n for n, i in enumerate(self.interactions) if matches(i)]
+                for n in candidates:
+                    if not self.used[n]:
+                        self.used[n] = True
+                        return self.interactions[n]
+                if candidates:
+                    return self.interactions[candidates[-1]]
+        raise CassetteMissError(f"No recorded response for {request.method} {request.url}", request=request)
+
+    def send(self, request, **kwargs):
+        timings.mark_once("first request")
+        interaction = self.find(request)
+        if self.delay:
+            time.sleep(self.delay)
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.reason = interaction["reason"]
+        response.headers = CaseInsensitiveDict(interaction["headers"])
+        if interaction["encoding"] == "base64":
+            response._content = base64.b64decode(interaction["body"])
+        else:
+            response._content = interaction["body"].encode("utf-8")
+        response._content_consumed = True
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = timedelta(seconds=self.delay)
+        return response
+
+
+# The adapter every new session uses, shared so every athlete's requests count against the same limits
+adapter: HTTPAdapter = ServiceAdapter()
+
+
+def new_session() -> requests.Session:
+    session = requests.Session()
+    session.hooks["response"].append(metrics.record_response)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def start_recording(path: Path) -> None:
+    global adapter
+    adapter = RecordingAdapter(path)
+
+
+def start_replay(path: Path, delay: float = 0) -> None:
+    global adapter
+    adapter = ReplayAdapter(path, delay)
+
+
+def stop() -> None:
+    """Stops recording or replaying, and closes every connection. A recording is only written to its cassette here."""
+    global adapter
+    adapter.close()
+    adapter = ServiceAdapter()